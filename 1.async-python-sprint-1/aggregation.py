@@ -0,0 +1,142 @@
+import math
+from typing import Iterable, Optional, Sequence
+
+from forecast import NO_CONDITION, CityForecast, condition_codes
+
+DRY_CONDITIONS = ('clear', 'partly-cloudy', 'cloudy', 'overcast',)
+REDUCERS = ('mean', 'sum', 'min', 'max', 'count')
+
+
+class Metric:
+    """Показатель одного дня: значения поля часа field за часы
+    [hours[0], hours[1]) сводятся функцией how:
+    mean, sum, min, max – по часам, где значение есть;
+    count – число часов, погодное условие которых входит в conditions.
+    Если в окне нет ни одного значения, показатель дня – None.
+    digits – точность округления значений по дням и среднего"""
+
+    def __init__(self, name: str, field: str = 'temp', how: str = 'mean',
+                 hours: tuple[int, int] = (9, 20),
+                 conditions: Iterable[str] = (), label: str = '',
+                 digits: Optional[int] = 1):
+        if how not in REDUCERS:
+            raise ValueError(f'unknown reducer {how} for metric {name}')
+        if (how == 'count') != (field == 'condition'):
+            raise ValueError(f'metric {name}: count works only '
+                             f'with the condition field')
+        self.name = name
+        self.field = field
+        self.how = how
+        self.hours = hours
+        self.conditions = tuple(conditions)
+        self.codes = condition_codes(self.conditions)
+        self.label = label or name
+        self.digits = digits
+
+    def __repr__(self) -> str:
+        return (f'Metric({self.name!r}, {self.field!r}, {self.how!r}, '
+                f'{self.hours!r}, {self.conditions!r}, '
+                f'digits={self.digits!r})')
+
+    def reduce(self, values) -> Optional[float]:
+        """Значение показателя по срезу столбца за один день"""
+        if self.how == 'count':
+            known = [code for code in values if code != NO_CONDITION]
+            if not known:
+                return None
+            return sum(code in self.codes for code in known)
+        known = [value for value in values if not math.isnan(value)]
+        if not known:
+            return None
+        if self.how == 'mean':
+            value = sum(known) / len(known)
+        elif self.how == 'sum':
+            value = sum(known)
+        elif self.how == 'min':
+            value = min(known)
+        else:
+            value = max(known)
+        return self.round(value)
+
+    def round(self, value: float) -> float:
+        return round(value, self.digits) if self.digits is not None \
+            else value
+
+
+DEFAULT_METRICS = (
+    Metric('temp', 'temp', 'mean', label='Температура, среднее'),
+    Metric('hours', 'condition', 'count', conditions=DRY_CONDITIONS,
+           label='Без осадков, часов', digits=None),
+)
+
+
+class MetricSet:
+    """Набор показателей, которые считаются за один проход по дням
+    прогноза. days – срез дней прогноза [начало, конец);
+    rank_by – имена показателей для рейтинга по убыванию, имя с минусом
+    впереди сортируется по возрастанию (например, '-wind')"""
+
+    def __init__(self, metrics: Sequence[Metric] = DEFAULT_METRICS,
+                 days: tuple[int, Optional[int]] = (0, None),
+                 rank_by: Optional[Iterable[str]] = None):
+        self.metrics = tuple(metrics)
+        self.names = tuple(metric.name for metric in self.metrics)
+        if len(set(self.names)) != len(self.names):
+            raise ValueError('metric names must be unique')
+        self.days = days
+        self.rank_by = tuple(rank_by) if rank_by else self.names
+        self._rank = []
+        for name in self.rank_by:
+            ascending = name.startswith('-')
+            name = name.lstrip('-')
+            if name not in self.names:
+                raise ValueError(f'unknown metric {name} in rank_by')
+            self._rank.append((self.names.index(name), ascending))
+
+    def __repr__(self) -> str:
+        return (f'MetricSet({list(self.metrics)!r}, days={self.days!r}, '
+                f'rank_by={self.rank_by!r})')
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        """Дополнительные поля часа, которые нужно сохранить
+        в CityForecast при разборе ответа"""
+        return tuple(sorted({metric.field for metric in self.metrics}
+                            - {'temp', 'condition'}))
+
+    def count_days(self, forecast: CityForecast) -> dict[str, dict]:
+        """Показатели по дням одного города"""
+        columns = [forecast.column(metric.field) for metric in self.metrics]
+        city_data = {}
+        for index in range(len(forecast))[slice(*self.days)]:
+            start, stop = forecast.offsets[index], forecast.offsets[index + 1]
+            day = {}
+            for metric, column in zip(self.metrics, columns):
+                first, last = metric.hours
+                values = () if column is None else \
+                    column[start + first:min(start + last, stop)]
+                day[metric.name] = metric.reduce(values)
+            city_data[forecast.dates[index]] = day
+        return city_data
+
+    def average(self, days: dict[str, dict]) -> tuple:
+        """Среднее каждого показателя по дням, где он есть"""
+        average = []
+        for metric in self.metrics:
+            values = [day[metric.name] for day in days.values()
+                      if day.get(metric.name) is not None]
+            average.append(metric.round(sum(values) / len(values))
+                           if values else None)
+        return tuple(average)
+
+    def rank_key(self, average: Sequence) -> tuple:
+        """Ключ сортировки по убыванию предпочтительности; отсутствующие
+        значения считаются худшими"""
+        key = []
+        for index, ascending in self._rank:
+            value = average[index]
+            if value is None:
+                key.append(-math.inf)
+            else:
+                key.append(-value if ascending else value)
+        return tuple(key)
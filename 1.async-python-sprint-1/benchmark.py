@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+
+from fixture_server import FixtureServer
+from tasks import DataAnalyzingTask, DataCalculationTask, DataFetchingTask
+
+
+def run_benchmark(cities: int, mode: str = 'async', engine: str = 'python',
+                  stream: bool = False, repeat: int = 3) -> dict:
+    """Прогоняет конвейер repeat раз на cities синтетических городах
+    локального сервера, возвращает отчёты запусков и медианы этапов"""
+    runs = []
+    with FixtureServer(variants=16) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        urls = server.city_urls(f'CITY{i}' for i in range(cities))
+        for _ in range(repeat):
+            dant = DataAnalyzingTask(
+                fetching=DataFetchingTask(mode, cities=urls, stream=stream),
+                calculation=DataCalculationTask(engine),
+                path=os.path.join(tmp, 'data.csv'))
+            dant.collect_data()
+            dant.save_to_csv()
+            runs.append(dant.report.as_dict())
+    stages = {name for run in runs for name in run['stages']}
+    median = {name: round(statistics.median(run['stages'].get(name, 0.0)
+                                            for run in runs), 6)
+              for name in sorted(stages)}
+    median['total'] = round(statistics.median(run['total'] for run in runs),
+                            6)
+    return {'cities': cities, 'mode': mode, 'engine': engine,
+            'stream': stream, 'median': median, 'runs': runs}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, nargs='+',
+                        default=[15, 100, 1000])
+    parser.add_argument('--mode', choices=['threads', 'async'],
+                        default='async')
+    parser.add_argument('--engine', choices=['python', 'numpy'],
+                        default='python')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='файл для json-отчёта')
+    args = parser.parse_args()
+    results = [run_benchmark(count, args.mode, args.engine, args.stream,
+                             args.repeat)
+               for count in args.cities]
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    print(text)
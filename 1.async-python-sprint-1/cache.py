@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+
+class CacheEntry:
+    """Закэшированный ответ и его валидаторы"""
+
+    def __init__(self, body: bytes, meta: dict):
+        self.body = body
+        self.meta = meta
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.meta['stored_at'] < ttl
+
+    def validators(self) -> dict[str, str]:
+        """Заголовки для условного запроса"""
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+
+class ForecastCache:
+    """Дисковый кэш ответов API по адресу города.
+    Запись атомарная (временный файл + os.replace),
+    при превышении max_bytes удаляются давно не читанные записи.
+    Размер кэша ведётся в памяти по размерам записанных файлов, каталог
+    обходится только при вытеснении; записи других процессов в тот же
+    каталог учитываются при следующем обходе. Счётчик размера защищён
+    замком, поэтому кэш можно использовать из нескольких потоков"""
+
+    # доля max_bytes, до которой освобождается кэш при вытеснении,
+    # чтобы следующий обход понадобился не на первой же записи
+    low_water = 0.9
+
+    def __init__(self, path: str = '.forecast_cache', ttl: float = 3 * 3600,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.sizes: dict[str, int] = {
+            key: size for _, size, key in self._scan()}
+        self.total = sum(self.sizes.values())
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # замок не передаётся в процессы пула, там создаётся свой
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _key(self, url: str) -> str:
+        return os.path.join(self.path,
+                            hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        key = self._key(url)
+        try:
+            with open(key + '.meta') as file:
+                meta = json.load(file)
+            with open(key + '.json', 'rb') as file:
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or meta.get('size') != len(body):
+            return None
+        os.utime(key + '.meta')
+        return CacheEntry(body, meta)
+
+    def put(self, url: str, body: bytes,
+            headers: Optional[dict[str, str]] = None) -> None:
+        headers = {name.lower(): value
+                   for name, value in (headers or {}).items()}
+        meta = {'url': url, 'stored_at': time.time(), 'size': len(body),
+                'etag': headers.get('etag'),
+                'last_modified': headers.get('last-modified')}
+        key = self._key(url)
+        data = json.dumps(meta).encode()
+        self._write_atomic(key + '.json', body)
+        self._write_atomic(key + '.meta', data)
+        if self._account(key, len(body) + len(data)):
+            self.evict()
+
+    def touch(self, entry: CacheEntry) -> None:
+        """Продлевает срок жизни записи после ответа 304"""
+        entry.meta['stored_at'] = time.time()
+        key = self._key(entry.meta['url'])
+        data = json.dumps(entry.meta).encode()
+        self._write_atomic(key + '.meta', data)
+        if self._account(key, len(entry.body) + len(data)):
+            self.evict()
+
+    def _account(self, key: str, size: int) -> bool:
+        """Учитывает новый размер записи; True, если кэш превысил
+        max_bytes"""
+        with self._lock:
+            self.total += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+            return self.total > self.max_bytes
+
+    def evict(self) -> None:
+        """Удаляет записи, начиная с самых давно использованных,
+        пока размер кэша не станет меньше low_water от max_bytes"""
+        with self._lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._scan())
+        self.sizes = {key: size for _, size, key in entries}
+        total = sum(self.sizes.values())
+        for _, size, key in entries:
+            if total <= self.max_bytes * self.low_water:
+                break
+            for suffix in ('.meta', '.json'):
+                try:
+                    os.remove(key + suffix)
+                except OSError:
+                    msg = f'failed to evict {key}{suffix}'
+                    logging.warning(msg)
+            total -= size
+            del self.sizes[key]
+        self.total = total
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        """Время последнего использования, размер и ключ каждой записи"""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.meta'):
+                continue
+            key = os.path.join(self.path, name[:-len('.meta')])
+            try:
+                size = (os.path.getsize(key + '.json')
+                        + os.path.getsize(key + '.meta'))
+                entries.append((os.path.getmtime(key + '.meta'), size, key))
+            except OSError:
+                continue
+        return entries
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
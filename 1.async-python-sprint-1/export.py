@@ -0,0 +1,135 @@
+import csv
+import os
+import sys
+import zipfile
+from array import array
+from itertools import islice
+from typing import Iterable, Iterator, Sequence
+
+from aggregation import DEFAULT_METRICS, Metric
+
+Record = tuple[str, str, dict[str, dict], tuple, int]
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+class ResultExporter:
+    """Запись результатов анализа из основного процесса пачками.
+    Запись – (город, название, данные по дням, средние, рейтинг),
+    показатели дня и средние – в порядке metrics.
+    Форматы: csv – таблица из задания, npz – столбцы для numpy.load"""
+
+    formats = ('csv', 'npz')
+
+    def __init__(self, dates: list[str], batch_size: int = 1000,
+                 metrics: Sequence[Metric] = DEFAULT_METRICS):
+        self.dates = dates
+        self.batch_size = batch_size
+        self.metrics = metrics
+
+    def write(self, path: str, records: Iterable[Record],
+              fmt: str = 'csv') -> None:
+        if fmt == 'csv':
+            self.write_csv(path, records)
+        elif fmt == 'npz':
+            self.write_npz(path, records)
+        else:
+            raise ValueError(f'unknown export format: {fmt}')
+
+    def batches(self, records: Iterable[Record]) -> Iterator[list[Record]]:
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def write_csv(self, path: str, records: Iterable[Record]) -> None:
+        field_names = ['Страна/день', '', *self.dates, 'Среднее', 'Рейтинг']
+        with open(path, 'w', encoding='UTF8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(field_names)
+            for batch in self.batches(records):
+                rows = []
+                for _, title, days, average, rate in batch:
+                    rows.extend(format_rows(title, days, average, rate,
+                                            self.metrics))
+                writer.writerows(rows)
+
+    def write_npz(self, path: str, records: Iterable[Record]) -> None:
+        """Столбцы cities, dates, по показателю <имя> (город × день)
+        и avg_<имя>, rank; нет значения – nan, у показателей count – -1"""
+        width = len(self.dates)
+        cities = []
+        columns = {metric.name: array('q' if metric.how == 'count' else 'd')
+                   for metric in self.metrics}
+        averages = {metric.name: array('d') for metric in self.metrics}
+        ranks = array('q')
+        for batch in self.batches(records):
+            for city, _, days, average, rate in batch:
+                values = list(days.values())[:width]
+                values += [{}] * (width - len(values))
+                cities.append(city)
+                for metric, mean in zip(self.metrics, average):
+                    column = columns[metric.name]
+                    empty = -1 if column.typecode == 'q' else float('nan')
+                    column.extend([empty if day.get(metric.name) is None
+                                   else day[metric.name] for day in values])
+                    averages[metric.name].append(
+                        float('nan') if mean is None else mean)
+                ranks.append(rate)
+        count = len(cities)
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as npz:
+            npz.writestr('cities.npy', npy_strings(cities))
+            npz.writestr('dates.npy', npy_strings(self.dates))
+            for name, column in columns.items():
+                npz.writestr(f'{name}.npy', npy_array(column, (count, width)))
+                npz.writestr(f'avg_{name}.npy',
+                             npy_array(averages[name], (count,)))
+            npz.writestr('rank.npy', npy_array(ranks, (count,)))
+
+
+def format_rows(title: str, days: dict[str, dict], average: tuple, rate,
+                metrics: Sequence[Metric] = DEFAULT_METRICS) -> list[list]:
+    """Строки таблицы для города, по одной на показатель;
+    рейтинг – в первой строке"""
+    rows = []
+    for index, metric in enumerate(metrics):
+        row = [title if not index else '', metric.label]
+        row.extend(cell(day.get(metric.name)) for day in days.values())
+        row += [cell(average[index]), rate if not index else '']
+        rows.append(row)
+    return rows
+
+
+def cell(value) -> object:
+    return '' if value is None else value
+
+
+def npy_header(descr: str, shape: tuple) -> bytes:
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': shape})
+    # длина заголовка вместе с магией выравнивается на 64 байта
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin-1')
+    return NPY_MAGIC + len(header).to_bytes(2, 'little') + header
+
+
+def npy_array(values: array, shape: tuple) -> bytes:
+    """Массив формата .npy из array.array ('d' или 'q')"""
+    descr = '<f8' if values.typecode == 'd' else '<i8'
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return npy_header(descr, shape) + values.tobytes()
+
+
+def npy_strings(values: list[str]) -> bytes:
+    """Массив строк numpy (<U) в кодировке UTF-32-LE"""
+    width = max((len(value) for value in values), default=1) or 1
+    data = b''.join(value.ljust(width, '\0').encode('utf-32-le')
+                    for value in values)
+    return npy_header(f'<U{width}', (len(values),)) + data
+
+
+def output_path(path: str, fmt: str) -> str:
+    return os.path.splitext(path)[0] + '.' + fmt
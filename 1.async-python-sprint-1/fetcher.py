@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import ssl
+from functools import partial
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlsplit
+
+from cache import ForecastCache
+from forecast import CityForecast
+from metrics import RunReport
+from resilience import CircuitOpenError, FetchPolicy, resilient_get
+from stream_parser import ForecastStreamParser
+
+ConnKey = tuple[str, str, int]
+CHUNK_SIZE = 64 * 1024
+
+
+class HTTPResponse:
+    """Ответ сервера: статус, заголовки и тело"""
+
+    def __init__(self, status: int, reason: str,
+                 headers: dict[str, str], body: bytes, size: int = 0):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.size = size
+
+    def json(self) -> dict:
+        return json.loads(self.body)
+
+
+class AsyncHTTPClient:
+    """Асинхронный HTTP/1.1 клиент с пулом keep-alive соединений,
+    ограничением числа одновременных запросов и таймаутом на запрос"""
+
+    def __init__(self, limit: int = 50, timeout: float = 10.0):
+        self.limit = limit
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle: dict[ConnKey, list] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._ssl = ssl.create_default_context()
+
+    async def __aenter__(self) -> 'AsyncHTTPClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def get(self, url: str,
+                  headers: Optional[dict[str, str]] = None,
+                  sink: Optional[ForecastStreamParser] = None
+                  ) -> HTTPResponse:
+        """GET-запрос с ограничением по времени и числу запросов в работе;
+        если передан sink, тело ответа по частям отдаётся в sink.feed
+        и не накапливается в памяти"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self._request(url, headers or {}, sink), self.timeout)
+
+    async def close(self) -> None:
+        """Закрывает все простаивающие соединения"""
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _request(self, url: str, headers: dict[str, str],
+                       sink: Optional[ForecastStreamParser]
+                       ) -> HTTPResponse:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname or '', port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = [f'GET {path} HTTP/1.1', f'Host: {parts.netloc}',
+                 'Connection: keep-alive', 'Accept-Encoding: identity']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        reused, reader, writer = await self._acquire(key)
+        try:
+            writer.write(request)
+            await writer.drain()
+            response, keep_alive = await self._read_response(reader, sink)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            # соединение из пула могло быть закрыто сервером, пробуем новое
+            reused, reader, writer = await self._acquire(key, fresh=True)
+            try:
+                writer.write(request)
+                await writer.drain()
+                response, keep_alive = await self._read_response(reader, sink)
+            except BaseException:
+                writer.close()
+                raise
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _acquire(self, key: ConnKey, fresh: bool = False) -> tuple:
+        idle = self._idle.get(key, [])
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return True, reader, writer
+            writer.close()
+        scheme, host, port = key
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl if scheme == 'https' else None)
+        self.connections_opened += 1
+        return False, reader, writer
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader,
+                             sink: Optional[ForecastStreamParser]
+                             ) -> tuple[HTTPResponse, bool]:
+        head = await reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        version, status, *reason = status_line.split(' ', 2)
+        headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = (version == 'HTTP/1.1'
+                      and headers.get('connection', '').lower() != 'close')
+        if int(status) != 200:
+            sink = None
+        chunks: list[bytes] = []
+        size = 0
+
+        def consume(chunk: bytes) -> None:
+            nonlocal size
+            size += len(chunk)
+            if sink is not None:
+                sink.feed(chunk)
+            else:
+                chunks.append(chunk)
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            await read_chunked(reader, consume)
+        elif 'content-length' in headers:
+            await read_length(reader, int(headers['content-length']),
+                              consume)
+        elif int(status) not in (204, 304):
+            await read_until_eof(reader, consume)
+            keep_alive = False
+        response = HTTPResponse(int(status), ' '.join(reason), headers,
+                                b''.join(chunks), size)
+        return response, keep_alive
+
+
+async def read_chunked(reader: asyncio.StreamReader,
+                       consume: Callable[[bytes], None]) -> None:
+    """Тело с Transfer-Encoding: chunked"""
+    while True:
+        size_line = await reader.readuntil(b'\r\n')
+        length = int(size_line.split(b';')[0], 16)
+        chunk = await reader.readexactly(length + 2)
+        if length == 0:
+            break
+        consume(chunk[:-2])
+
+
+async def read_length(reader: asyncio.StreamReader, left: int,
+                      consume: Callable[[bytes], None]) -> None:
+    """Тело известной длины, частями не больше CHUNK_SIZE"""
+    while left:
+        chunk = await reader.readexactly(min(left, CHUNK_SIZE))
+        left -= len(chunk)
+        consume(chunk)
+
+
+async def read_until_eof(reader: asyncio.StreamReader,
+                         consume: Callable[[bytes], None]) -> None:
+    """Тело до закрытия соединения"""
+    while True:
+        chunk = await reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        consume(chunk)
+
+
+async def fetch_forecasts(urls: dict[str, str], limit: int = 50,
+                          timeout: float = 10.0,
+                          cache: Optional[ForecastCache] = None,
+                          stream: bool = False,
+                          report: Optional[RunReport] = None,
+                          client: Optional[AsyncHTTPClient] = None,
+                          policy: Optional[FetchPolicy] = None,
+                          fields: Iterable[str] = ()
+                          ) -> dict[str, CityForecast]:
+    """Загружает прогнозы по всем городам через один пул соединений,
+    возвращает словарь город – CityForecast с дополнительными полями
+    часа fields.
+    При stream=True из ответа потоково извлекаются только нужные поля.
+    В report копятся загруженные байты и время разбора (parse).
+    Переданный client не закрывается, и его соединения остаются тёплыми
+    для следующих вызовов в том же цикле событий. policy задаёт повторы,
+    дублирующие запросы, предохранители и общий срок; города, которые не
+    удалось загрузить, отмечаются в report.failed"""
+    if client is None:
+        async with AsyncHTTPClient(limit, timeout) as client:
+            return await fetch_forecasts(urls, cache=cache, stream=stream,
+                                         report=report, client=client,
+                                         policy=policy, fields=fields)
+    report = report or RunReport()
+    policy = policy or FetchPolicy()
+    fetch = _CityFetch(client, cache, stream, report, policy, fields)
+    tasks = {asyncio.ensure_future(fetch(city, url)): city
+             for city, url in urls.items()}
+    if not tasks:
+        return fetch.data
+    _, pending = await asyncio.wait(tasks, timeout=policy.deadline)
+    for task in pending:
+        task.cancel()
+        fetch.fail(tasks[task], 'deadline exceeded')
+    await asyncio.gather(*pending, return_exceptions=True)
+    return fetch.data
+
+
+class _CityFetch:
+    """Загрузка прогноза одного города в рамках fetch_forecasts:
+    кэш, запрос по политике, разбор и учёт ошибок в report"""
+
+    def __init__(self, client: AsyncHTTPClient,
+                 cache: Optional[ForecastCache], stream: bool,
+                 report: RunReport, policy: FetchPolicy,
+                 fields: Iterable[str]):
+        self.client = client
+        self.cache = cache
+        self.stream = stream
+        self.report = report
+        self.policy = policy
+        self.fields = tuple(fields)
+        self.load = load_forecasts_stream if stream else load_forecasts
+        self.data: dict[str, CityForecast] = {}
+
+    def loads(self, body: bytes) -> CityForecast:
+        with self.report.stage('parse'):
+            return self.load(body, self.fields)
+
+    async def __call__(self, city: str, url: str) -> None:
+        """Загружает город; любая ошибка отмечается в report, иначе
+        город пропал бы в gather без следа"""
+        try:
+            await self.fetch(city, url)
+        except asyncio.TimeoutError:
+            self.fail(city, 'request timed out')
+        except CircuitOpenError as ex:
+            self.fail(city, f'circuit open for {ex}')
+        except Exception as ex:
+            self.fail(city, repr(ex))
+
+    async def fetch(self, city: str, url: str) -> None:
+        cache = self.cache
+        entry = cache.get(url) if cache is not None else None
+        if entry is not None and entry.is_fresh(cache.ttl):
+            self.data[city] = self.loads(entry.body)
+            return
+        headers = entry.validators() if entry is not None else {}
+        sink_factory = partial(ForecastStreamParser, self.fields) \
+            if self.stream and not cache else None
+        response, sink = await resilient_get(
+            self.client, url, headers, self.policy, sink_factory)
+        self.accept(city, url, entry, response, sink)
+
+    def accept(self, city: str, url: str, entry, response: HTTPResponse,
+               sink: Optional[ForecastStreamParser]) -> None:
+        self.report.count('bytes_fetched', response.size)
+        if response.status == 304 and entry is not None:
+            self.cache.touch(entry)
+            self.data[city] = self.loads(entry.body)
+        elif response.status != 200:
+            self.fail(city, f'{response.status} {response.reason}')
+        elif sink is not None:
+            with self.report.stage('parse'):
+                self.data[city] = sink.close()
+        else:
+            self.data[city] = self.loads(response.body)
+            if self.cache is not None:
+                self.cache.put(url, response.body, response.headers)
+
+    def fail(self, city: str, reason: str) -> None:
+        msg = f'{city}: {reason}'
+        logging.error(msg)
+        self.report.fail(city, reason)
+
+
+def load_forecasts(body: bytes, fields: Iterable[str] = ()) -> CityForecast:
+    return CityForecast.from_forecasts(json.loads(body)['forecasts'], fields)
+
+
+def load_forecasts_stream(body: bytes,
+                          fields: Iterable[str] = ()) -> CityForecast:
+    parser = ForecastStreamParser(fields)
+    parser.feed(body)
+    return parser.close()
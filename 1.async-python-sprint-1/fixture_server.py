@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+RESPONSE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'examples', 'response.json')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Отдаёт examples/response.json на любой GET-запрос; для адресов
+    из server.script сначала отрабатывает заданные ответы"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        bodies = self.server.bodies
+        body = bodies[zlib.crc32(self.path.encode()) % len(bodies)]
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        self.server.requests += 1
+        steps = self.server.script.get(self.path)
+        if steps:
+            status, delay = steps.pop(0)
+            time.sleep(delay)
+            if status != 200:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FixtureHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FixtureServer:
+    """Локальная замена API Яндекс.Погоды для тестов и бенчмарков.
+    При variants > 1 городам по адресу достаются разные варианты ответа
+    со сдвинутой температурой, чтобы рейтинг не был одинаковым"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 path: str = RESPONSE_PATH, variants: int = 1):
+        self.httpd = FixtureHTTPServer((host, port), FixtureHandler)
+        with open(path, 'rb') as file:
+            body = file.read()
+        self.httpd.bodies = [body]
+        if variants > 1:
+            self.httpd.bodies = [synthetic_response(body, shift)
+                                 for shift in range(variants)]
+        self.httpd.requests = 0
+        self.httpd.script = {}
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def requests(self) -> int:
+        return self.httpd.requests
+
+    def city_urls(self, cities) -> dict[str, str]:
+        """Адреса прогнозов для списка городов на этом сервере"""
+        return {city: f'{self.url}/{city.lower()}-response.json'
+                for city in cities}
+
+    def script(self, url: str, steps: list[tuple[int, float]]) -> None:
+        """Задаёт ответы на очередные запросы к url: код и задержка
+        в секундах; после них url отвечает как обычно"""
+        path = url[len(self.url):]
+        self.httpd.script[path] = list(steps)
+
+    def __enter__(self) -> 'FixtureServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def synthetic_response(body: bytes, shift: int) -> bytes:
+    """Ответ API с температурой, сдвинутой на shift градусов"""
+    response = json.loads(body)
+    for forecast in response['forecasts']:
+        for hour in forecast['hours']:
+            hour['temp'] += shift
+    return json.dumps(response).encode()
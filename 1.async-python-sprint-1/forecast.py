@@ -0,0 +1,106 @@
+import math
+from array import array
+from typing import Iterable, Iterator, Optional
+
+CONDITIONS = ('clear', 'partly-cloudy', 'cloudy', 'overcast', 'drizzle',
+              'light-rain', 'rain', 'moderate-rain', 'heavy-rain',
+              'continuous-heavy-rain', 'showers', 'wet-snow', 'light-snow',
+              'snow', 'snow-showers', 'hail', 'thunderstorm',
+              'thunderstorm-with-rain', 'thunderstorm-with-hail')
+CONDITION_CODES = {name: code for code, name in enumerate(CONDITIONS)}
+NO_CONDITION = -1
+
+
+def condition_codes(names: Iterable[str]) -> frozenset[int]:
+    """Коды известных погодных условий из списка названий"""
+    return frozenset(CONDITION_CODES[name] for name in names
+                     if name in CONDITION_CODES)
+
+
+class CityForecast:
+    """Прогноз одного города: даты и плотные массивы почасовых
+    температур (float32, nan – нет данных) и кодов погодных условий
+    (int8, NO_CONDITION – нет данных или условие неизвестно).
+    Часы дня index лежат в срезе offsets[index]:offsets[index + 1].
+    Из остальных числовых полей часа хранятся только перечисленные
+    в fields – каждое в своём столбце columns[поле]"""
+
+    __slots__ = ('dates', 'offsets', 'temps', 'conditions', 'columns')
+
+    def __init__(self, fields: Iterable[str] = ()):
+        self.dates: list[str] = []
+        self.offsets = array('I', [0])
+        self.temps = array('f')
+        self.conditions = array('b')
+        self.columns = {field: array('f') for field in fields}
+
+    @classmethod
+    def from_forecasts(cls, forecasts,
+                       fields: Iterable[str] = ()) -> 'CityForecast':
+        """Строит модель из forecasts[] ответа API"""
+        if isinstance(forecasts, cls):
+            return forecasts
+        city = cls(fields)
+        for forecast in forecasts:
+            for hour in forecast.get('hours', ()):
+                city.add_hour(hour.get('temp'), hour.get('condition'),
+                              {field: hour.get(field)
+                               for field in city.columns})
+            city.end_day(forecast.get('date'))
+        return city
+
+    def add_hour(self, temp: Optional[float], condition: Optional[str],
+                 values: Optional[dict] = None) -> None:
+        """Добавляет час к текущему, ещё не закрытому дню;
+        values – значения дополнительных полей"""
+        self.temps.append(math.nan if temp is None else temp)
+        self.conditions.append(CONDITION_CODES.get(condition, NO_CONDITION))
+        for field, column in self.columns.items():
+            value = values.get(field) if values else None
+            column.append(math.nan if value is None else value)
+
+    def column(self, field: str) -> Optional[array]:
+        """Почасовой столбец поля или None, если поле не сохранялось"""
+        if field == 'temp':
+            return self.temps
+        if field == 'condition':
+            return self.conditions
+        return self.columns.get(field)
+
+    def end_day(self, date: Optional[str]) -> None:
+        """Закрывает день: добавленные после прошлого дня часы
+        относятся к date"""
+        self.dates.append(date)
+        self.offsets.append(len(self.temps))
+
+    def day(self, index: int) -> tuple[str, array, array]:
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return (self.dates[index], self.temps[start:stop],
+                self.conditions[start:stop])
+
+    def __iter__(self) -> Iterator[tuple[str, array, array]]:
+        for index in range(len(self.dates)):
+            yield self.day(index)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CityForecast):
+            return NotImplemented
+        return (self.dates == other.dates and self.offsets == other.offsets
+                and self.temps.tobytes() == other.temps.tobytes()
+                and self.conditions == other.conditions
+                and {field: column.tobytes()
+                     for field, column in self.columns.items()}
+                == {field: column.tobytes()
+                    for field, column in other.columns.items()})
+
+    def to_forecasts(self) -> list[dict]:
+        """Обратное преобразование в вид forecasts[] ответа API"""
+        return [{'date': date,
+                 'hours': [{'temp': None if math.isnan(temp) else temp,
+                            'condition': CONDITIONS[code]
+                            if code != NO_CONDITION else None}
+                           for temp, code in zip(temps, conditions)]}
+                for date, temps, conditions in self]
@@ -1,19 +1,98 @@
+import argparse
 from datetime import datetime
+import time
+from typing import Optional
 
-from tasks import DataAnalyzingTask
+from cache import ForecastCache
+from registry import DEFAULT_REGISTRY, CityRegistry
+from resilience import FetchPolicy
+from service import ForecastService
+from store import AggregateStore
+from tasks import (DataAggregationTask, DataAnalyzingTask,
+                   DataCalculationTask, DataFetchingTask,
+                   ShardedAnalyzingTask, WeatherPipeline)
 
 
-def forecast_weather():
+def forecast_weather(registry: str = DEFAULT_REGISTRY,
+                     shard_size: int = 0, report: str = '',
+                     deadline: Optional[float] = None, store: str = '',
+                     cache: Optional[ForecastCache] = None):
     """
-    Анализ погодных условий по городам
+    Анализ погодных условий по городам; store – файл с результатами
+    прошлых запусков, города с прежними прогнозами не пересчитываются;
+    cache – дисковый кэш ответов API
     """
     start = datetime.now()
-    dant = DataAnalyzingTask()
+    policy = FetchPolicy(deadline)
+    cities = CityRegistry.load(registry)
+    if shard_size:
+        dant = ShardedAnalyzingTask(cities, shard_size, policy=policy,
+                                    cache=cache)
+    else:
+        aggregates = AggregateStore(store) if store else None
+        dant = DataAnalyzingTask(
+            DataFetchingTask(cities=cities.urls, cache=cache, policy=policy),
+            DataCalculationTask(store=aggregates),
+            DataAggregationTask(store=aggregates, titles=cities.titles))
     dant.collect_data()
     dant.save_to_csv()
     print(dant.choose_best())
     print(datetime.now() - start)
+    if report:
+        dant.report.save(report)
+
+
+def serve_forecasts(registry: str = DEFAULT_REGISTRY,
+                    interval: float = 600.0, store: str = '',
+                    cache: Optional[ForecastCache] = None):
+    """
+    Режим сервиса: обновление рейтинга раз в interval секунд
+    """
+    cities = CityRegistry.load(registry)
+    pipeline = WeatherPipeline(cities.urls, titles=cities.titles,
+                               cache=cache,
+                               store=AggregateStore(store) if store else None)
+    with pipeline, ForecastService(pipeline, interval) as service:
+        shown = 0
+        try:
+            while True:
+                if service.refreshes != shown:
+                    shown = service.refreshes
+                    print(datetime.now(), service.snapshot.best)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == "__main__":
-    forecast_weather()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--registry', default=DEFAULT_REGISTRY,
+                        help='json или csv файл со списком городов')
+    parser.add_argument('--shard-size', type=int, default=0,
+                        help='обрабатывать реестр пачками такого размера')
+    parser.add_argument('--report',
+                        help='файл для json-отчёта о времени этапов')
+    parser.add_argument('--serve', type=float, metavar='SECONDS',
+                        help='работать сервисом, обновляя рейтинг '
+                             'с таким интервалом')
+    parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='общий срок загрузки прогнозов; города, '
+                             'не загруженные к сроку, отмечаются в отчёте')
+    parser.add_argument('--store', metavar='PATH',
+                        help='файл с результатами прошлых запусков; '
+                             'не совмещается с --shard-size')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='каталог дискового кэша ответов API')
+    parser.add_argument('--cache-ttl', type=float, default=3 * 3600,
+                        metavar='SECONDS',
+                        help='срок, в течение которого ответ из кэша '
+                             'используется без запроса')
+    args = parser.parse_args()
+    if args.store and args.shard_size:
+        parser.error('--store cannot be used with --shard-size')
+    cache = ForecastCache(args.cache, args.cache_ttl) if args.cache else None
+    if args.serve:
+        serve_forecasts(args.registry, args.serve, args.store, cache)
+    else:
+        forecast_weather(args.registry, args.shard_size, args.report,
+                         args.deadline, args.store, cache)
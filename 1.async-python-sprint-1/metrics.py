@@ -0,0 +1,59 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class RunReport:
+    """Метрики одного запуска конвейера: время этапов, счётчики
+    и загрузка пула процессов; выгружается в json"""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.pool_busy = 0.0
+        self.pool_capacity = 0.0
+        self.failed: dict[str, str] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def fail(self, city: str, reason: str) -> None:
+        """Отмечает город, данные которого не получены"""
+        self.failed[city] = reason
+
+    def add_pool(self, processes: int, wall: float, busy: float) -> None:
+        """Учитывает работу пула: busy – суммарное время обработчиков"""
+        self.pool_busy += busy
+        self.pool_capacity += processes * wall
+
+    def as_dict(self) -> dict:
+        utilization = None
+        if self.pool_capacity:
+            utilization = round(self.pool_busy / self.pool_capacity, 3)
+        return {'total': round(time.perf_counter() - self.started, 6),
+                'stages': {name: round(seconds, 6)
+                           for name, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+                'pool_utilization': utilization,
+                'partial': bool(self.failed),
+                'failed': dict(self.failed)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as file:
+            file.write(self.to_json())
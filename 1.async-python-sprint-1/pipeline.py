@@ -0,0 +1,49 @@
+from typing import Any, Callable, Iterable, Optional
+
+from metrics import RunReport
+
+
+class Stage:
+    """Этап конвейера: функция и этапы, результаты которых она принимает"""
+
+    def __init__(self, name: str, func: Callable, deps: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StageGraph:
+    """Граф этапов конвейера. Каждый этап выполняется не больше одного раза
+    за запуск, его результат передаётся зависящим этапам по ссылке"""
+
+    def __init__(self, report: Optional[RunReport] = None):
+        self.stages: dict[str, Stage] = {}
+        self.results: dict[str, Any] = {}
+        self.report = report or RunReport()
+
+    def add(self, name: str, func: Callable,
+            deps: Iterable[str] = ()) -> None:
+        for dep in deps:
+            if dep not in self.stages:
+                raise KeyError(f'unknown stage {dep} for {name}')
+        self.stages[name] = Stage(name, func, deps)
+
+    def result(self, name: str) -> Any:
+        """Результат этапа; этап и его зависимости запускаются,
+        только если ещё не выполнялись"""
+        if name not in self.results:
+            stage = self.stages[name]
+            args = [self.result(dep) for dep in stage.deps]
+            with self.report.stage(name):
+                self.results[name] = stage.func(*args)
+        return self.results[name]
+
+    def provide(self, name: str, value: Any) -> None:
+        """Подставляет готовый результат этапа, сам этап не запускается"""
+        if name not in self.stages:
+            raise KeyError(f'unknown stage {name}')
+        self.results[name] = value
+
+    def reset(self) -> None:
+        """Сбрасывает результаты для нового запуска"""
+        self.results = {}
@@ -0,0 +1,85 @@
+import heapq
+from typing import Callable, Iterator, Optional
+
+
+class CityRanking:
+    """Рейтинг городов на куче с ленивым удалением. Обновление города –
+    O(log n), первые k мест – O(k log k) без сортировки всего набора.
+    key – ключ предпочтительности по средним значениям (больше – лучше);
+    города с равным ключом образуют группу и упорядочены по времени
+    первого появления в рейтинге"""
+
+    def __init__(self, key: Callable[[tuple], tuple]):
+        self.key = key
+        self.values: dict[str, tuple] = {}
+        self._entries: dict[str, tuple] = {}
+        self._order: dict[str, int] = {}
+        self._heap: list[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, city: str) -> bool:
+        return city in self._entries
+
+    def get(self, city: str) -> Optional[tuple]:
+        return self.values.get(city)
+
+    def update(self, city: str, average: tuple) -> bool:
+        """Ставит или обновляет город; False, если значения не изменились"""
+        if city in self._entries and self.values[city] == average:
+            return False
+        order = self._order.setdefault(city, len(self._order))
+        entry = (tuple(-value for value in self.key(average)), order, city)
+        self.values[city] = average
+        self._entries[city] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        return True
+
+    def discard(self, city: str) -> None:
+        """Убирает город из рейтинга; запись в куче удаляется лениво"""
+        self.values.pop(city, None)
+        self._entries.pop(city, None)
+
+    def top(self, count: int, ties: bool = False) -> list[tuple[str, tuple]]:
+        """Первые count мест; при ties к ним добавляются города,
+        равные последнему из них"""
+        leaders: list[tuple] = []
+        for entry in self._iter():
+            if len(leaders) >= count and (
+                    not ties or entry[0] != leaders[-1][0]):
+                break
+            leaders.append(entry)
+        return [(city, self.values[city]) for _, _, city in leaders]
+
+    def leaders(self) -> list[str]:
+        """Группа городов, разделяющих первое место: как и раньше,
+        в неё входят все города с тем же первым показателем ключа, даже
+        если следующие показатели у них разные"""
+        leaders: list[tuple] = []
+        for entry in self._iter():
+            if leaders and entry[0][0] != leaders[0][0][0]:
+                break
+            leaders.append(entry)
+        return [city for _, _, city in leaders]
+
+    def ordered(self) -> dict[str, tuple]:
+        """Весь рейтинг по порядку, например для выгрузки"""
+        return {city: self.values[city]
+                for _, _, city in sorted(self._entries.values())}
+
+    def _iter(self) -> Iterator[tuple]:
+        """Действующие записи кучи по порядку без её изменения:
+        обход дерева кучи с очередью из ещё не выданных вершин"""
+        heap = self._heap
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            if self._entries.get(entry[2]) is entry:
+                yield entry
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
@@ -0,0 +1,49 @@
+import csv
+import json
+import os
+from itertools import islice
+from typing import Iterator
+
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'cities.json')
+
+
+class CityRegistry:
+    """Список городов: ключ, адрес прогноза и название для отчёта.
+    Загружается из json (список объектов name/url/title)
+    или csv (столбцы name,url,title)"""
+
+    def __init__(self, urls: dict[str, str], titles: dict[str, str]):
+        self.urls = urls
+        self.titles = titles
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_REGISTRY) -> 'CityRegistry':
+        urls = {}
+        titles = {}
+        for name, url, title in cls._read(path):
+            urls[name] = url
+            titles[name] = title or name
+        return cls(urls, titles)
+
+    @staticmethod
+    def _read(path: str) -> Iterator[tuple[str, str, str]]:
+        with open(path, encoding='utf-8', newline='') as file:
+            if path.endswith('.csv'):
+                for row in csv.DictReader(file):
+                    yield row['name'], row['url'], row.get('title', '')
+            else:
+                for item in json.load(file):
+                    yield item['name'], item['url'], item.get('title', '')
+
+    def shards(self, size: int) -> Iterator[dict[str, str]]:
+        """Разбивает города на пачки не больше size"""
+        items = iter(self.urls.items())
+        while True:
+            shard = dict(islice(items, size))
+            if not shard:
+                return
+            yield shard
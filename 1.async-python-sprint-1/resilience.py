@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: для хоста сработал предохранитель"""
+
+
+class CircuitBreaker:
+    """Предохранитель для одного хоста: после threshold неудач подряд
+    запросы не отправляются reset секунд, затем пропускается один
+    пробный запрос"""
+
+    def __init__(self, threshold: int = 5, reset: float = 30.0):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < self.reset:
+            return False
+        self.trial = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.trial = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class FetchPolicy:
+    """Ограничения хвостовых задержек загрузки:
+    deadline – общий срок загрузки всех городов, после него оставшиеся
+    запросы отменяются, а города помечаются как незагруженные;
+    retries – число повторов с экспоненциальной задержкой backoff·2^n
+    (не больше max_backoff) и случайным разбросом;
+    hedge_percentile – если ответа нет дольше этого перцентиля уже
+    замеренных задержек (нужно не меньше hedge_min_samples замеров),
+    отправляется дублирующий запрос и берётся первый ответ;
+    breaker_threshold/breaker_reset – параметры предохранителя хоста.
+    Замеры задержек и предохранители хранятся в политике и переживают
+    отдельные запуски"""
+
+    def __init__(self, deadline: Optional[float] = None, retries: int = 2,
+                 backoff: float = 0.2, max_backoff: float = 5.0,
+                 hedge_percentile: Optional[float] = 0.95,
+                 hedge_min_samples: int = 20, breaker_threshold: int = 5,
+                 breaker_reset: float = 30.0):
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.latencies: deque = deque(maxlen=512)
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.hedges = 0
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.breaker_threshold,
+                                                 self.breaker_reset)
+        return self.breakers[host]
+
+    def hedge_delay(self) -> Optional[float]:
+        if (self.hedge_percentile is None
+                or len(self.latencies) < self.hedge_min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * self.hedge_percentile),
+                    len(ordered) - 1)
+        return ordered[index]
+
+    def retry_delay(self, attempt: int) -> float:
+        limit = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(limit / 2, limit)
+
+
+class RetryableStatus(Exception):
+    """Сервер ответил 5xx, запрос можно повторить"""
+
+    def __init__(self, response):
+        super().__init__(f'{response.status} {response.reason}')
+        self.response = response
+
+
+async def resilient_get(client, url: str, headers: dict[str, str],
+                        policy: FetchPolicy,
+                        sink_factory: Optional[Callable] = None) -> tuple:
+    """GET с предохранителем, повторами и дублирующим запросом;
+    возвращает ответ и sink, в который было прочитано его тело"""
+    breaker = policy.breaker(url)
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(urlsplit(url).netloc)
+        try:
+            result = await _hedged_get(client, url, headers, policy,
+                                       sink_factory)
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError,
+                RetryableStatus) as ex:
+            breaker.failure()
+            if attempt == policy.retries:
+                if isinstance(ex, RetryableStatus):
+                    return ex.response, None
+                raise
+            await asyncio.sleep(policy.retry_delay(attempt))
+            attempt += 1
+            continue
+        breaker.success()
+        return result
+
+
+async def _hedged_get(client, url: str, headers: dict[str, str],
+                      policy: FetchPolicy,
+                      sink_factory: Optional[Callable]) -> tuple:
+    delay = policy.hedge_delay()
+    pending = {asyncio.ensure_future(
+        _attempt(client, url, headers, policy, sink_factory))}
+    error: Optional[BaseException] = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                policy.hedges += 1
+                pending.add(asyncio.ensure_future(
+                    _attempt(client, url, headers, policy, sink_factory)))
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _attempt(client, url: str, headers: dict[str, str],
+                   policy: FetchPolicy,
+                   sink_factory: Optional[Callable]) -> tuple:
+    sink = sink_factory() if sink_factory is not None else None
+    start = time.perf_counter()
+    response = await client.get(url, headers, sink)
+    if response.status >= 500:
+        raise RetryableStatus(response)
+    policy.latencies.append(time.perf_counter() - start)
+    return response, sink
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import threading
+import time
+from functools import partial
+from typing import Optional
+
+from fetcher import AsyncHTTPClient, fetch_forecasts
+from metrics import RunReport
+from ranking import CityRanking
+from tasks import WeatherPipeline
+
+
+class ForecastSnapshot:
+    """Результат одного обновления; после публикации не изменяется.
+    Хранит только таблицу лидеров – первые size мест вместе с городами,
+    делящими последнее из них"""
+
+    def __init__(self, ranking: CityRanking, report: dict, size: int = 100):
+        self.leaderboard = ranking.top(size, ties=True)
+        self.leaders = ranking.leaders()
+        self.best = ' '.join(self.leaders)
+        self.ranks = {city: ind + 1
+                      for ind, (city, _) in enumerate(self.leaderboard)}
+        self.cities = len(ranking)
+        self.report = report
+        self.created_at = time.time()
+
+    def rank(self, city: str) -> Optional[int]:
+        """Место города или None, если он не попал в таблицу лидеров"""
+        return self.ranks.get(city)
+
+    def top(self, count: int) -> list[tuple[str, tuple]]:
+        return self.leaderboard[:count]
+
+
+class ForecastService:
+    """Режим сервиса: в фоновом потоке с собственным циклом событий
+    держит тёплыми пул HTTP-соединений и пул процессов, раз в interval
+    секунд обновляет прогнозы и атомарно подменяет снимок рейтинга.
+    Рейтинг живёт между обновлениями: в куче переставляются только
+    города с изменившимися средними, город, который не удалось загрузить,
+    остаётся с прошлыми значениями. Читатели получают готовый снимок
+    с top лидерами без пересчёта. Переданный pipeline остаётся
+    у вызывающего, созданный по умолчанию закрывается в stop"""
+
+    def __init__(self, pipeline: Optional[WeatherPipeline] = None,
+                 interval: float = 600.0, top: int = 100):
+        self._owns_pipeline = pipeline is None
+        self.pipeline = pipeline or WeatherPipeline()
+        self.interval = interval
+        self.top = top
+        self.ranking = CityRanking(self.pipeline.metrics.rank_key)
+        self.snapshot: Optional[ForecastSnapshot] = None
+        self.refreshes = 0
+        self.client: Optional[AsyncHTTPClient] = None
+        self._ready = threading.Event()
+        self._error: Optional[Exception] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._started = threading.Event()
+
+    def __enter__(self) -> 'ForecastService':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self, wait: bool = True,
+              timeout: Optional[float] = None) -> 'ForecastService':
+        """Запускает фоновый поток; при wait ждёт первого снимка,
+        если первое обновление не удалось, останавливает сервис
+        и пробрасывает исключение"""
+        if len(self.pipeline.cities) >= self.pipeline.min_parallel:
+            self.pipeline.get_pool()
+        self._thread = threading.Thread(target=asyncio.run,
+                                        args=(self._serve(),), daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if wait:
+            try:
+                self.wait_ready(timeout)
+            except Exception:
+                self.stop()
+                raise
+        return self
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт первого снимка; если его не удалось получить,
+        пробрасывает исключение первого обновления"""
+        ready = self._ready.wait(timeout)
+        if self.snapshot is None and self._error is not None:
+            raise self._error
+        return ready
+
+    def refresh(self) -> None:
+        """Просит обновить снимок, не дожидаясь конца интервала"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._loop.call_soon_threadsafe(self._wake.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._owns_pipeline:
+            self.pipeline.close()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._started.set()
+        try:
+            await self._refresh_forever()
+        except Exception as ex:
+            self._error = ex
+            raise
+        finally:
+            # ожидающие первого снимка не должны зависнуть,
+            # если цикл завершился раньше
+            self._ready.set()
+
+    async def _refresh_forever(self) -> None:
+        options = self.pipeline.fetch_options
+        async with AsyncHTTPClient(options['limit'],
+                                   options['timeout']) as client:
+            self.client = client
+            while not self._stop.is_set():
+                self._wake.clear()
+                try:
+                    await self._refresh(client)
+                except Exception as ex:
+                    msg = f'forecast refresh failed: {ex!r}'
+                    logging.error(msg)
+                    if self.snapshot is None:
+                        self._error = ex
+                        self._ready.set()
+                if self._stop.is_set():
+                    break
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _refresh(self, client: AsyncHTTPClient) -> None:
+        options = self.pipeline.fetch_options
+        report = RunReport()
+        with report.stage('fetch'):
+            raw_data = await fetch_forecasts(
+                self.pipeline.cities, cache=options['cache'],
+                stream=options['stream'], report=report, client=client,
+                policy=options['policy'], fields=options['fields'])
+        dant = await self._loop.run_in_executor(
+            None, partial(self.pipeline.analyze, raw_data=raw_data,
+                          until='aggregate'))
+        dant.report.stages.update(report.stages)
+        dant.report.counters.update(report.counters)
+        dant.report.failed.update(report.failed)
+        with dant.report.stage('rank'):
+            for city in [city for city in self.ranking.values
+                         if city not in self.pipeline.cities]:
+                self.ranking.discard(city)
+            changed = sum(self.ranking.update(city, average) for city, average
+                          in dant.aggregation.average_data.items())
+            dant.report.count('cities_reranked', changed)
+        self.snapshot = ForecastSnapshot(self.ranking, dant.report.as_dict(),
+                                         self.top)
+        self.refreshes += 1
+        self._ready.set()
+        msg = f'snapshot #{self.refreshes}: best {self.snapshot.best}'
+        logging.info(msg)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from forecast import CityForecast
+
+
+class AggregateStore:
+    """Сохраняемые между запусками результаты по городам вместе с хешем
+    прогнозов, из которых они получены. Пересчитываются только города,
+    у которых хеш изменился; средние хранятся с хешем данных по дням,
+    поэтому не зависят от того, какая задача эти данные подсчитала.
+    Один экземпляр можно использовать из нескольких потоков"""
+
+    def __init__(self, path: str = 'aggregates.json'):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            msg = f'broken aggregate store {path}, starting from scratch'
+            logging.warning(msg)
+
+    @staticmethod
+    def digest(forecasts: CityForecast, spec: str = '') -> str:
+        """Хеш прогнозов и описания spec показателей, которые
+        по ним считаются"""
+        digest = hashlib.sha256(json.dumps([spec, forecasts.dates,
+                                            sorted(forecasts.columns)])
+                                .encode())
+        for column in (forecasts.offsets, forecasts.temps,
+                       forecasts.conditions,
+                       *(forecasts.columns[field]
+                         for field in sorted(forecasts.columns))):
+            digest.update(column.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def days_digest(days: dict, spec: str = '') -> str:
+        """Хеш подсчитанных по дням данных, из которых получено
+        среднее"""
+        return hashlib.sha256(json.dumps([spec, days], sort_keys=True)
+                              .encode()).hexdigest()
+
+    def get_days(self, city: str, digest: str) -> Optional[dict]:
+        """Подсчитанные по дням данные, если прогнозы не изменились"""
+        entry = self.entries.get(city)
+        if entry is None or entry['hash'] != digest:
+            return None
+        return entry['days']
+
+    def put_days(self, city: str, digest: str, days: dict) -> None:
+        with self._lock:
+            entry = self.entries.setdefault(city, {})
+            entry['hash'] = digest
+            entry['days'] = days
+
+    def get_average(self, city: str, digest: str
+                    ) -> Optional[tuple[float, float]]:
+        """Средние значения, если данные по дням не изменились"""
+        entry = self.entries.get(city)
+        if entry is None or entry.get('average_hash') != digest:
+            return None
+        return tuple(entry['average'])
+
+    def put_average(self, city: str, digest: str,
+                    average: tuple[float, float]) -> None:
+        with self._lock:
+            entry = self.entries.setdefault(city, {'hash': None,
+                                                   'days': None})
+            entry['average_hash'] = digest
+            entry['average'] = list(average)
+
+    def save(self) -> None:
+        """Атомарно записывает хранилище на диск"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file, self._lock:
+                json.dump(self.entries, file)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
@@ -0,0 +1,155 @@
+import json
+import re
+from typing import Any, BinaryIO, Iterable, Optional
+
+from forecast import CityForecast
+
+TOKEN = re.compile(rb'''
+    \s*(?:
+        (?P<punct>[{}\[\],:])
+      | (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<literal>true|false|null)
+    )''', re.VERBOSE)
+WHITESPACE = re.compile(rb'\s*')
+NUMBER_TAIL = frozenset(b'0123456789.eE+-')
+LITERALS = {b'true': True, b'false': False, b'null': None}
+
+ROOT, FORECASTS, FORECAST, HOURS, HOUR, SKIP = range(6)
+
+
+class Frame:
+    """Открытый объект или массив и ключ, значение которого разбирается"""
+
+    __slots__ = ('kind', 'is_object', 'key', 'expect_key', 'value')
+
+    def __init__(self, kind: int, is_object: bool, value: Any = None):
+        self.kind = kind
+        self.is_object = is_object
+        self.key: Optional[bytes] = None
+        self.expect_key = is_object
+        self.value = value
+
+
+class ForecastStreamParser:
+    """Потоковый разбор ответа API: из байтов по частям извлекаются
+    только forecasts[].date, forecasts[].hours[].temp/condition
+    и дополнительные поля часа fields; они сразу складываются
+    в CityForecast, остальные поля пропускаются без построения объектов"""
+
+    def __init__(self, fields: Iterable[str] = ()):
+        self.forecast = CityForecast(fields)
+        self.fields = {field.encode(): field for field in fields}
+        self._stack: list[Frame] = []
+        self._buffer = b''
+        self._done = False
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        self._consume(final=False)
+
+    def close(self) -> CityForecast:
+        self._consume(final=True)
+        if self._stack or not self._done:
+            raise ValueError('incomplete JSON document')
+        return self.forecast
+
+    def _consume(self, final: bool) -> None:
+        buffer = self._buffer
+        pos = 0
+        end = len(buffer)
+        while True:
+            match = TOKEN.match(buffer, pos)
+            if match is None:
+                break
+            if not final and match.lastgroup in ('number', 'literal') and (
+                    match.end() == end or buffer[match.end()] in NUMBER_TAIL):
+                # токен оборван границей блока, ждём следующий
+                break
+            pos = match.end()
+            self._token(match.lastgroup, match.group(match.lastgroup))
+        tail = WHITESPACE.match(buffer, pos).end()
+        if final and tail != end:
+            raise ValueError(f'invalid JSON at byte {tail}')
+        self._buffer = buffer[tail:]
+
+    def _token(self, kind: Optional[str], token: bytes) -> None:
+        top = self._stack[-1] if self._stack else None
+        if kind == 'punct':
+            if token == b'{' or token == b'[':
+                self._open(top, token == b'{')
+            elif token == b'}' or token == b']':
+                self._close()
+            elif token == b',':
+                if top.is_object:
+                    top.expect_key = True
+            else:
+                top.expect_key = False
+        elif top is not None and top.is_object and top.expect_key:
+            top.key = token[1:-1] if b'\\' not in token else \
+                json.loads(token).encode()
+        else:
+            self._scalar(top, kind, token)
+
+    def _open(self, top: Optional[Frame], is_object: bool) -> None:
+        if top is None:
+            kind = ROOT if is_object else SKIP
+        elif top.kind == ROOT and top.key == b'forecasts':
+            kind = FORECASTS if not is_object else SKIP
+        elif top.kind == FORECASTS:
+            kind = FORECAST if is_object else SKIP
+        elif top.kind == FORECAST and top.key == b'hours':
+            kind = HOURS if not is_object else SKIP
+        elif top.kind == HOURS:
+            kind = HOUR if is_object else SKIP
+        else:
+            kind = SKIP
+        # у дня значение – дата, у часа – температура, условие
+        # и словарь дополнительных полей
+        value = [None, None, {}] if kind == HOUR else None
+        self._stack.append(Frame(kind, is_object, value))
+
+    def _close(self) -> None:
+        frame = self._stack.pop()
+        if not self._stack:
+            self._done = True
+            return
+        if frame.kind == FORECAST:
+            self.forecast.end_day(frame.value)
+        elif frame.kind == HOUR:
+            self.forecast.add_hour(*frame.value)
+
+    def _scalar(self, top: Optional[Frame], kind: Optional[str],
+                token: bytes) -> None:
+        if top is None:
+            return
+        if top.kind == FORECAST:
+            if top.key == b'date':
+                top.value = self._value(kind, token)
+        elif top.kind == HOUR:
+            if top.key == b'temp':
+                top.value[0] = self._value(kind, token)
+            elif top.key == b'condition':
+                top.value[1] = self._value(kind, token)
+            elif top.key in self.fields:
+                top.value[2][self.fields[top.key]] = self._value(kind, token)
+
+    @staticmethod
+    def _value(kind: Optional[str], token: bytes) -> Any:
+        if kind == 'string':
+            return json.loads(token)
+        if kind == 'number':
+            return float(token)
+        return LITERALS[token]
+
+
+def parse_forecasts(stream: BinaryIO, chunk_size: int = 64 * 1024,
+                    fields: Iterable[str] = ()) -> CityForecast:
+    """Разбирает прогнозы из файлового объекта блоками по chunk_size"""
+    parser = ForecastStreamParser(fields)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.close()
@@ -1,68 +1,217 @@
-from concurrent.futures import ThreadPoolExecutor
-import csv
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+import json
 import logging
-from multiprocessing import Pipe, Pool, Process, cpu_count
-from multiprocessing.connection import Connection
-
-from utils import CITIES, YandexWeatherAPI
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import Pool as PoolType
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from aggregation import DRY_CONDITIONS, MetricSet
+from cache import ForecastCache
+from export import ResultExporter, output_path
+from fetcher import fetch_forecasts
+from forecast import CityForecast
+from metrics import RunReport
+from pipeline import StageGraph
+from ranking import CityRanking
+from registry import CityRegistry
+from resilience import FetchPolicy
+from store import AggregateStore
+from utils import CITIES, REGISTRY, YandexWeatherAPI
+from vectorized import count_metrics_vectorized
 
 logging.basicConfig()
 
 
+def parallel_map(func: Callable, items: list, chunksize: int = 64,
+                 min_parallel: int = 500,
+                 report: Optional[RunReport] = None,
+                 pool: Optional[PoolType] = None,
+                 processes: Optional[int] = None) -> list:
+    """Применяет func к элементам пулом процессов через imap_unordered;
+    если элементов меньше min_parallel, запуск пула не окупается
+    и обработка идёт в текущем процессе. Переданный pool используется
+    повторно, иначе пул создаётся на время вызова; processes – число
+    процессов в пуле, по нему считается загрузка пула в report"""
+    if len(items) < min_parallel:
+        return [func(item) for item in items]
+    start = time.perf_counter()
+    processes = processes or max(cpu_count() - 1, 1)
+    if pool is not None:
+        timed = list(pool.imap_unordered(partial(timed_call, func), items,
+                                         chunksize))
+    else:
+        with Pool(processes) as own_pool:
+            timed = list(own_pool.imap_unordered(
+                partial(timed_call, func), items, chunksize))
+    if report is not None:
+        report.add_pool(processes, time.perf_counter() - start,
+                        sum(elapsed for elapsed, _ in timed))
+    return [result for _, result in timed]
+
+
+def timed_call(func: Callable, item) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(item)
+    return time.perf_counter() - start, result
+
+
+def count_city(item: tuple[str, CityForecast],
+               metrics: Optional[MetricSet] = None) -> tuple[str, dict]:
+    """Обработчик одного города для пула: в процесс передаются
+    только прогнозы этого города"""
+    city, forecasts = item
+    return city, DataCalculationTask.count_city_days(forecasts, metrics)
+
+
+def average_city(item: tuple[str, dict],
+                 metrics: Optional[MetricSet] = None) -> tuple[str, tuple]:
+    city, days = item
+    return city, DataAggregationTask.average_city(days, metrics)
+
+
+def process_shard(item: tuple[dict[str, str], dict, MetricSet]
+                  ) -> tuple[list[tuple], dict[str, str], dict[str, int]]:
+    """Обработчик пачки городов для пула: загрузка, подсчёт по дням
+    и усреднение; возвращает только компактные результаты, а также
+    не загруженные города и счётчики загрузки для отчёта"""
+    shard, options, metrics = item
+    report = RunReport()
+    raw_data = asyncio.run(fetch_forecasts(shard, fields=metrics.fields,
+                                           report=report, **options))
+    rows = []
+    for city in shard:
+        if city not in raw_data:
+            continue
+        days = DataCalculationTask.count_city_days(raw_data.pop(city),
+                                                   metrics)
+        rows.append((city, days,
+                     DataAggregationTask.average_city(days, metrics)))
+    return rows, report.failed, report.counters
+
+
 class DataFetchingTask:
 
-    data = {}
+    def __init__(self, mode: str = 'async', limit: int = 50,
+                 timeout: float = 10.0, cities: dict[str, str] = CITIES,
+                 cache: Optional[ForecastCache] = None,
+                 stream: bool = False,
+                 policy: Optional[FetchPolicy] = None,
+                 fields: tuple[str, ...] = ()):
+        """mode='async' – один пул соединений, не более limit запросов
+        одновременно и timeout секунд на запрос, с учётом загруженных
+        байтов и времени разбора в отчёте;
+        mode='threads' – поток на город через YandexWeatherAPI, без
+        повторов, дублирующих запросов и предохранителей;
+        cache – необязательный дисковый кэш ответов;
+        stream – потоковый разбор только нужных полей ответа;
+        policy – повторы, дублирующие запросы и общий срок загрузки,
+        в режиме threads учитывается только срок;
+        fields – дополнительные поля часа для показателей MetricSet"""
+        self.mode = mode
+        self.limit = limit
+        self.timeout = timeout
+        self.cities = cities
+        self.cache = cache
+        self.stream = stream
+        self.policy = policy or FetchPolicy()
+        self.fields = fields
+        self.data: dict[str, CityForecast] = {}
+        self.report: Optional[RunReport] = None
 
     def fetch_data(self, city: str):
         """Получает данные с помощью YandexWeatherAPI
         для отдельно взятого города"""
         try:
-            ywapi = YandexWeatherAPI()
-            resp = ywapi.get_forecasting(city)
-            self.data[city] = resp['forecasts']
-        except NameError:
-            logging.critical('incorrect dictionary key')
+            ywapi = YandexWeatherAPI(self.cache, self.stream, self.timeout,
+                                     self.fields)
+            resp = ywapi.get_forecasting_by_url(self.cities[city])
+            self.data[city] = CityForecast.from_forecasts(resp['forecasts'],
+                                                          self.fields)
+        except Exception as ex:
+            msg = f'{city}: {ex}'
+            logging.error(msg)
+            if self.report is not None:
+                self.report.fail(city, str(ex))
 
     def collect_data(self) -> None:
-        """Собирает данные по всем городам"""
-        with ThreadPoolExecutor() as executor:
-            for city in CITIES:
-                executor.submit(self.fetch_data, city=city)
+        """Собирает данные по всем городам; города, не загруженные
+        до срока policy.deadline, отмечаются в отчёте"""
+        if self.mode == 'async':
+            self.data.update(asyncio.run(fetch_forecasts(
+                self.cities, self.limit, self.timeout, self.cache,
+                self.stream, self.report, policy=self.policy,
+                fields=self.fields)))
+            return
+        executor = ThreadPoolExecutor()
+        futures = {executor.submit(self.fetch_data, city=city): city
+                   for city in self.cities}
+        _, pending = wait(futures, timeout=self.policy.deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+        for future in pending:
+            msg = f'{futures[future]}: deadline exceeded'
+            logging.error(msg)
+            if self.report is not None:
+                self.report.fail(futures[future], 'deadline exceeded')
 
-    def get_data(self) -> dict[str, list]:
-        """Возвращает собранные данные"""
-        return self.data
+    def get_data(self) -> dict[str, CityForecast]:
+        """Возвращает собранные данные в порядке списка городов"""
+        return {city: self.data[city] for city in self.cities
+                if city in self.data}
 
 
 class DataCalculationTask:
 
-    raw_data = {}
-    counted_data = {}
-    not_rain_conditions = ('clear', 'partly-cloudy', 'cloudy', 'overcast',)
+    not_rain_conditions = DRY_CONDITIONS
+
+    def __init__(self, engine: str = 'python', chunksize: int = 64,
+                 min_parallel: int = 500,
+                 store: Optional[AggregateStore] = None,
+                 pool: Optional[PoolType] = None,
+                 metrics: Optional[MetricSet] = None,
+                 processes: Optional[int] = None):
+        """engine='python' – обход словарей по часам,
+        engine='numpy' – векторизованный подсчёт по плотным массивам;
+        города обрабатываются пулом процессов пачками по chunksize,
+        если их не меньше min_parallel, иначе – в текущем процессе;
+        store – результаты прошлых запусков, пересчитываются только
+        города с изменившимися прогнозами;
+        pool – общий пул процессов вместо создаваемого на каждый вызов,
+        processes – число процессов в нём или в создаваемом пуле;
+        metrics – набор показателей по дням, по умолчанию средняя
+        температура и часы без осадков с 9 до 19 часов"""
+        self.engine = engine
+        self.chunksize = chunksize
+        self.min_parallel = min_parallel
+        self.store = store
+        self.pool = pool
+        self.processes = processes
+        self.metrics = metrics or MetricSet()
+        self.raw_data: dict[str, CityForecast] = {}
+        self.counted_data: dict[str, dict] = {}
+        self.report: Optional[RunReport] = None
+
+    @classmethod
+    def count_city_days(cls, forecasts: CityForecast,
+                        metrics: Optional[MetricSet] = None
+                        ) -> dict[str, dict]:
+        """Подсчитывает показатели по дням для одного города,
+        по умолчанию – среднюю температуру и часы без осадков"""
+        return (metrics or MetricSet()).count_days(forecasts)
 
     def count_av_temp(self, cities: list) -> None:
         """Подсчитывает среднюю температуру, записывает результат в словарь,
         где ключ – название города, значение – словарь,
         который ссодержит температуру и количество часов"""
-        city_data = {}
         try:
             for city in cities:
-                for forecast in self.raw_data[city]:
-                    hours = 0
-                    temp = 0
-                    try:
-                        for hour in forecast['hours'][9:20]:
-                            temp += hour['temp']
-                            if hour['condition'] in self.not_rain_conditions:
-                                hours += 1
-                    except KeyError:
-                        logging.error('check the keys is lines 46-48')
-                    temp /= 10
-                    temp = round(temp, 1)
-                    city_data[forecast['date']] = {'temp': temp,
-                                                   'hours': hours}
-                self.counted_data[city] = city_data
+                self.counted_data[city] = self.count_city_days(
+                    self.raw_data[city], self.metrics)
         except KeyError:
             msg = f'no such city: {city}'
             logging.error(msg)
@@ -70,12 +219,43 @@ class DataCalculationTask:
 
     def collect_data(self) -> None:
         """Собирает данные по средней температуре и часам без осадков"""
-        dft = DataFetchingTask()
+        dft = DataFetchingTask(fields=self.metrics.fields)
         dft.collect_data()
-        self.raw_data = dft.get_data()
-        cpun = cpu_count() - 1
-        with Pool(cpun) as pool:
-            self.counted_data = pool.apply(self.count_av_temp, args=(CITIES,))
+        self.calculate(dft.get_data())
+
+    def calculate(self, raw_data: dict[str, CityForecast]) -> dict[str, dict]:
+        """Подсчитывает погодные параметры по уже загруженным данным"""
+        self.raw_data = raw_data
+        if self.store is None:
+            results = self.count(raw_data)
+        else:
+            results = {}
+            changed = {}
+            digests = {}
+            for city, forecasts in raw_data.items():
+                digests[city] = self.store.digest(forecasts,
+                                                  repr(self.metrics))
+                days = self.store.get_days(city, digests[city])
+                if days is None:
+                    changed[city] = forecasts
+                else:
+                    results[city] = days
+            msg = f'recalculating {len(changed)} of {len(raw_data)} cities'
+            logging.info(msg)
+            for city, days in self.count(changed).items():
+                self.store.put_days(city, digests[city], days)
+                results[city] = days
+        self.counted_data = {city: results[city] for city in raw_data
+                             if city in results}
+        return self.counted_data
+
+    def count(self, raw_data: dict[str, CityForecast]) -> dict[str, dict]:
+        if self.engine == 'numpy':
+            return count_metrics_vectorized(raw_data, raw_data, self.metrics)
+        return dict(parallel_map(partial(count_city, metrics=self.metrics),
+                                 list(raw_data.items()), self.chunksize,
+                                 self.min_parallel, self.report, self.pool,
+                                 self.processes))
 
     def get_aggregated_data(self) -> dict[str, dict[str, float]]:
         """Возвращает собранные данные"""
@@ -84,18 +264,27 @@ class DataCalculationTask:
 
 class DataAggregationTask:
 
-    data = {}
-    average_data = {}
-    dates = []
-    cities = {'MOSCOW': 'Москва', 'PARIS': 'Париж', 'LONDON': 'Лондон',
-              'BERLIN': 'Берлин', 'BEIJING': 'Пекин',
-              'KAZAN': 'Казань', 'SPETERSBURG': 'Санкт-Петербург',
-              'VOLGOGRAD': 'Волгоград',
-              'NOVOSIBIRSK': 'Новосибирск', 'KALININGRAD': 'Калининград',
-              'ABUDHABI': 'Абу-Даби',
-              'WARSZAWA': 'Варшава', 'BUCHAREST': 'Бухарест',
-              'ROMA': 'Рим', 'CAIRO': 'Каир'}
-    rates = {}
+    def __init__(self, chunksize: int = 64, min_parallel: int = 500,
+                 store: Optional[AggregateStore] = None,
+                 pool: Optional[PoolType] = None,
+                 titles: Optional[dict[str, str]] = None,
+                 metrics: Optional[MetricSet] = None,
+                 processes: Optional[int] = None):
+        """Параметры параллельной обработки городов, хранилище результатов
+        прошлых запусков, пул и показатели, как у DataCalculationTask;
+        titles – названия городов для отчёта"""
+        self.chunksize = chunksize
+        self.min_parallel = min_parallel
+        self.store = store
+        self.pool = pool
+        self.processes = processes
+        self.metrics = metrics or MetricSet()
+        self.cities = titles if titles is not None else REGISTRY.titles
+        self.data: dict[str, dict] = {}
+        self.average_data: dict[str, tuple] = {}
+        self.ranking = CityRanking(self.rank_key)
+        self.dates: list[str] = []
+        self.report: Optional[RunReport] = None
 
     def parse_date(self, date_to_parse: str) -> str:
         """парсит дату в нужном формате"""
@@ -104,129 +293,313 @@ class DataAggregationTask:
         return date
 
     def set_data(self) -> None:
-        dct = DataCalculationTask()
+        dct = DataCalculationTask(metrics=self.metrics)
         dct.collect_data()
         self.data = dct.get_aggregated_data()
 
-    def get_average_data(self) -> dict[str, tuple[float, float]]:
+    def get_average_data(self) -> dict[str, tuple]:
         return self.average_data
 
+    @staticmethod
+    def average_city(days: dict[str, dict],
+                     metrics: Optional[MetricSet] = None) -> tuple:
+        """Средние значения показателей за дни, где они есть,
+        в порядке metrics.names"""
+        return (metrics or MetricSet()).average(days)
+
     def aggregate_data_for_city(self, cities: list) -> None:
-        av_temp = 0
-        av_hours = 0
         try:
             for city in cities:
-                for day, data in self.data[city].items():
-                    if len(self.dates) < 5:
-                        date = self.parse_date(day)
-                        self.dates.append(date)
-                    av_temp += data['temp']
-                    av_hours += data['hours']
-                av_temp /= 5
-                av_hours /= 5
-                av_temp = round(av_temp, 1)
-                self.average_data[city] = av_temp, av_hours
+                self.average_data[city] = self.average_city(self.data[city],
+                                                            self.metrics)
         except KeyError:
-            logging.error('check the keys in lines 105-114')
+            msg = f'no such city: {city}'
+            logging.error(msg)
         return self.average_data
 
     def collect_data(self) -> None:
         self.set_data()
-        cpun = cpu_count() - 1
-        with Pool(cpun) as pool:
-            self.average_data = pool.apply(self.aggregate_data_for_city,
-                                           args=(CITIES,))
-
-    def sort_cities(self) -> dict[str, tuple[float, float]]:
-        """Сортирует города в порядке убывания предпочтительности
-        по температуре и часам"""
-        sorted_cities_dict = dict(
-            sorted(self.average_data.items(),
-                   key=lambda item: (item[1][0], item[1][1]),
-                   reverse=True))
-        return sorted_cities_dict
-
-    def rate_cities(self, sorted_cities: list, conn: Connection) -> None:
-        """Назначает рейтинги городам"""
-        for ind, el in enumerate(sorted_cities):
-            conn.send((el, ind + 1))
-        conn.send(None)
-
-    def write_to_csv(self, conn: Connection) -> None:
-        """Запись в файл"""
-        field_names = ['Страна/день', '', '26-05', '27-05',
-                       '28-05', '29-05', '30-05', 'Среднее', 'Рейтинг']
-        with open('data.csv', 'w', encoding='UTF8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(field_names)
-            while True:
-                data = conn.recv()
-                if data is None:
-                    break
-                city, rate = data
-                row = []
-                row2 = []
-                gorod = self.cities[city]
-                row.append(gorod)
-                row2.append('')
-                row.append('Температура, среднее')
-                row2.append('Без осадков, часов')
-                try:
-                    for _, day in self.data[city].items():
-                        row.append(day['temp'])
-                        row2.append(day['hours'])
-                except KeyError:
-                    msg = f'can\'t find such city: {city}'
-                    logging.error(msg)
-                try:
-                    row.append(self.average_data[city][0])
-                    row2.append(self.average_data[city][1])
-                    row.append(rate)
-                except (KeyError, IndexError):
-                    logging.error('check indexes and keys in lines 157-159')
-                row2.append('')
-                writer.writerow(row)
-                writer.writerow(row2)
+        self.aggregate(self.data)
+
+    def aggregate(self, data: dict[str, dict]) -> dict[str, tuple]:
+        """Усредняет уже подсчитанные по дням данные"""
+        self.data = data
+        items = list(data.items())
+        if items:
+            self.dates = [self.parse_date(day) for day in items[0][1]]
+        results = {}
+        digests = {}
+        if self.store is not None:
+            for city, days in items:
+                digests[city] = self.store.days_digest(days,
+                                                       repr(self.metrics))
+                average = self.store.get_average(city, digests[city])
+                if average is not None:
+                    results[city] = average
+            items = [item for item in items if item[0] not in results]
+        results.update(parallel_map(partial(average_city,
+                                            metrics=self.metrics),
+                                    items, self.chunksize,
+                                    self.min_parallel, self.report,
+                                    self.pool, self.processes))
+        self.average_data = {city: results[city] for city in data}
+        if self.store is not None:
+            for city, _ in items:
+                self.store.put_average(city, digests[city], results[city])
+            self.store.save()
+        return self.average_data
 
+    def rank_key(self, average: tuple) -> tuple:
+        return self.metrics.rank_key(average)
 
-class DataAnalyzingTask:
+    def sort_cities(self, average_data: Optional[dict] = None
+                    ) -> dict[str, tuple]:
+        """Приводит рейтинг к average_data, переставляя в куче только
+        изменившиеся города, и возвращает города в порядке убывания
+        предпочтительности по показателям metrics.rank_by"""
+        if average_data is None:
+            average_data = self.average_data
+        for city in [city for city in self.ranking.values
+                     if city not in average_data]:
+            self.ranking.discard(city)
+        for city, average in average_data.items():
+            self.ranking.update(city, average)
+        return self.ranking.ordered()
 
-    sorted_cities = {}
 
-    def collect_data(self) -> None:
-        """Собирает данные для выбора лучшего города и записи в файл"""
-        dat = DataAggregationTask()
-        dat.set_data()
-        dat.collect_data()
-        self.sorted_cities = dat.sort_cities()
+class DataAnalyzingTask:
+
+    def __init__(self, fetching: Optional[DataFetchingTask] = None,
+                 calculation: Optional[DataCalculationTask] = None,
+                 aggregation: Optional[DataAggregationTask] = None,
+                 path: str = 'data.csv', formats: tuple = ('csv',),
+                 metrics: Optional[MetricSet] = None):
+        """Строит граф этапов fetch → calculate → aggregate → rank → export,
+        каждый этап выполняется один раз за запуск;
+        formats – форматы выгрузки из ResultExporter.formats;
+        metrics – показатели для всех этапов, по умолчанию берутся
+        из calculation"""
+        self.path = path
+        self.formats = formats
+        self.sorted_cities: dict[str, tuple] = {}
+        self.report = RunReport()
+        self.fetching = fetching or DataFetchingTask()
+        self.calculation = calculation or DataCalculationTask()
+        self.aggregation = aggregation or DataAggregationTask()
+        self.metrics = metrics or self.calculation.metrics
+        self.fetching.fields = self.metrics.fields
+        for task in (self.calculation, self.aggregation):
+            task.metrics = self.metrics
+        for task in (self.fetching, self.calculation, self.aggregation):
+            task.report = self.report
+        self.graph = StageGraph(self.report)
+        self.graph.add('fetch', self.fetch)
+        self.graph.add('calculate', self.calculation.calculate, ['fetch'])
+        self.graph.add('aggregate', self.aggregation.aggregate,
+                       ['calculate'])
+        self.graph.add('rank', self.aggregation.sort_cities, ['aggregate'])
+        self.graph.add('export', self.export, ['rank'])
+
+    def fetch(self) -> dict[str, CityForecast]:
+        self.fetching.collect_data()
+        return self.fetching.get_data()
+
+    def collect_data(self, until: str = 'rank') -> None:
+        """Собирает данные для выбора лучшего города и записи в файл;
+        until='aggregate' останавливается на средних значениях, не
+        упорядочивая весь список городов"""
+        result = self.graph.result(until)
+        if until == 'rank':
+            self.sorted_cities = result
+        self.report.counters['cities_processed'] = len(result)
 
     def get_sorted_cities(self) -> dict[str, tuple]:
         """Возвращает словарь с отсортированными городами"""
         return self.sorted_cities
 
     def choose_best(self) -> str:
-        """Выбирает лучший для поездки город"""
-        best_cities = []
-        dct = self.get_sorted_cities()
-        try:
-            first = list(dct.keys())[0]
-            for key, value in dct.items():
-                if value[0] == dct[first][0]:
-                    best_cities.append(key)
-            best_cities = ' '.join(best_cities)
-        except IndexError:
+        """Выбирает лучшие для поездки города – группу первого места"""
+        best_cities = self.aggregation.ranking.leaders()
+        if not best_cities:
             logging.error('failed aggregated data in DataAnalyzingTask')
-        return best_cities
+        return ' '.join(best_cities)
+
+    def save_to_csv(self) -> None:
+        self.graph.result('export')
+
+    def export(self, sorted_cities: dict[str, tuple]) -> None:
+        """Пишет результаты пачками из текущего процесса"""
+        dat = self.aggregation
+        exporter = ResultExporter(dat.dates, metrics=self.metrics.metrics)
+        for fmt in self.formats:
+            records = ((city, dat.cities.get(city, city), dat.data[city],
+                        average, ind + 1)
+                       for ind, (city, average)
+                       in enumerate(sorted_cities.items()))
+            exporter.write(output_path(self.path, fmt), records, fmt)
+
+
+class ShardedAnalyzingTask:
+    """Анализ большого реестра городов пачками по shard_size в пуле
+    процессов. Результаты каждой пачки сразу дописываются во временный
+    файл, в памяти остаются только средние значения для рейтинга.
+    Загрузка и подсчёт идут внутри пачек, поэтому граф этапов
+    DataAnalyzingTask не используется, а рейтинг ведёт общий
+    DataAggregationTask"""
+
+    def __init__(self, registry: CityRegistry = REGISTRY,
+                 shard_size: int = 1000, processes: Optional[int] = None,
+                 path: str = 'data.csv', formats: tuple = ('csv',),
+                 limit: int = 50, timeout: float = 10.0,
+                 stream: bool = False,
+                 policy: Optional[FetchPolicy] = None,
+                 metrics: Optional[MetricSet] = None,
+                 cache: Optional[ForecastCache] = None):
+        """policy.deadline ограничивает загрузку каждой пачки;
+        cache – дисковый кэш ответов, общий для процессов пула"""
+        self.registry = registry
+        self.shard_size = shard_size
+        self.processes = processes or max(cpu_count() - 1, 1)
+        self.path = path
+        self.formats = formats
+        self.options = {'limit': limit, 'timeout': timeout,
+                        'stream': stream, 'policy': policy, 'cache': cache}
+        self.metrics = metrics or MetricSet()
+        self.aggregation = DataAggregationTask(titles=registry.titles,
+                                               metrics=self.metrics)
+        self.average_data: dict[str, tuple] = {}
+        self.sorted_cities: dict[str, tuple] = {}
+        self.report = RunReport()
+
+    def collect_data(self) -> None:
+        """Обрабатывает пачки городов, записывая результаты по мере
+        готовности каждой пачки; рейтинг пополняется так же по мере
+        готовности, поэтому лидеры известны без итоговой сортировки"""
+        self.average_data = {}
+        ranking = self.aggregation.ranking
+        shards = ((shard, self.options, self.metrics)
+                  for shard in self.registry.shards(self.shard_size))
+        with open(self.path + '.part', 'w', encoding='UTF8') as part, \
+                Pool(self.processes) as pool, self.report.stage('shards'):
+            for rows, failed, counters in pool.imap_unordered(process_shard,
+                                                              shards):
+                self.report.failed.update(failed)
+                for name, value in counters.items():
+                    self.report.count(name, value)
+                for city, days, average in rows:
+                    if not self.aggregation.dates:
+                        self.aggregation.dates = [
+                            self.aggregation.parse_date(day) for day in days]
+                    self.average_data[city] = average
+                    ranking.update(city, average)
+                    part.write(json.dumps([city, days, average]) + '\n')
+        with self.report.stage('rank'):
+            self.sorted_cities = ranking.ordered()
+        self.report.counters['cities_processed'] = len(self.sorted_cities)
+
+    def get_sorted_cities(self) -> dict[str, tuple]:
+        return self.sorted_cities
+
+    def choose_best(self) -> str:
+        """Группа городов первого места, как у DataAnalyzingTask"""
+        best_cities = self.aggregation.ranking.leaders()
+        if not best_cities:
+            logging.error('failed aggregated data in ShardedAnalyzingTask')
+        return ' '.join(best_cities)
 
     def save_to_csv(self) -> None:
-        dat = DataAggregationTask()
-        dat.set_data()
-        dat.collect_data()
-        conn_sender, conn_reciever = Pipe()
-        sender = Process(target=dat.rate_cities,
-                         args=(self.sorted_cities, conn_sender,))
-        sender.start()
-        reciever = Process(target=dat.write_to_csv, args=(conn_reciever,))
-        reciever.start()
-        sender.join()
-        reciever.join()
+        """Дописывает рейтинг к построчно прочитанным результатам пачек"""
+        rates = {city: ind + 1
+                 for ind, city in enumerate(self.sorted_cities)}
+        exporter = ResultExporter(self.aggregation.dates,
+                                  metrics=self.metrics.metrics)
+        for fmt in self.formats:
+            with open(self.path + '.part', encoding='UTF8') as part, \
+                    self.report.stage('export'):
+                records = ((city, self.registry.titles[city], days, average,
+                            rates[city])
+                           for city, days, average in map(json.loads, part))
+                exporter.write(output_path(self.path, fmt), records, fmt)
+        os.remove(self.path + '.part')
+
+
+class WeatherPipeline:
+    """Долгоживущий реентерабельный конвейер: кэш ответов и пул процессов
+    общие, а всё состояние анализа создаётся заново для каждого вызова
+    analyze, поэтому анализы можно запускать одновременно из разных
+    потоков одного процесса"""
+
+    def __init__(self, cities: dict[str, str] = CITIES, mode: str = 'async',
+                 limit: int = 50, timeout: float = 10.0,
+                 cache: Optional[ForecastCache] = None, stream: bool = False,
+                 engine: str = 'python', chunksize: int = 64,
+                 min_parallel: int = 500, processes: Optional[int] = None,
+                 titles: Optional[dict[str, str]] = None,
+                 policy: Optional[FetchPolicy] = None,
+                 metrics: Optional[MetricSet] = None,
+                 store: Optional[AggregateStore] = None):
+        """store – общее для всех анализов хранилище результатов прошлых
+        запусков, как у DataCalculationTask"""
+        self.cities = cities
+        self.metrics = metrics or MetricSet()
+        self.store = store
+        self.fetch_options = {'mode': mode, 'limit': limit,
+                              'timeout': timeout, 'cache': cache,
+                              'stream': stream,
+                              'policy': policy or FetchPolicy(),
+                              'fields': self.metrics.fields}
+        self.engine = engine
+        self.chunksize = chunksize
+        self.min_parallel = min_parallel
+        self.processes = processes or max(cpu_count() - 1, 1)
+        self.titles = titles
+        self.pool: Optional[PoolType] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'WeatherPipeline':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def get_pool(self) -> PoolType:
+        """Общий пул процессов, создаётся при первом обращении"""
+        with self._lock:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+            return self.pool
+
+    def analyze(self, cities: Optional[dict[str, str]] = None,
+                path: Optional[str] = None, formats: tuple = ('csv',),
+                raw_data: Optional[dict[str, CityForecast]] = None,
+                until: str = 'rank') -> DataAnalyzingTask:
+        """Полный анализ с собственным состоянием; если задан path,
+        результаты выгружаются в файлы. Если переданы уже загруженные
+        raw_data, этап fetch не запускается; until – последний этап,
+        как в DataAnalyzingTask.collect_data"""
+        cities = cities if cities is not None else self.cities
+        pool = self.get_pool() if len(cities) >= self.min_parallel else None
+        dant = DataAnalyzingTask(
+            fetching=DataFetchingTask(cities=cities, **self.fetch_options),
+            calculation=DataCalculationTask(self.engine, self.chunksize,
+                                            self.min_parallel, self.store,
+                                            pool=pool,
+                                            processes=self.processes),
+            aggregation=DataAggregationTask(self.chunksize,
+                                            self.min_parallel, self.store,
+                                            pool=pool, titles=self.titles,
+                                            processes=self.processes),
+            path=path or 'data.csv', formats=formats, metrics=self.metrics)
+        if raw_data is not None:
+            dant.graph.provide('fetch', raw_data)
+        dant.collect_data(until)
+        if path:
+            dant.save_to_csv()
+        return dant
+
+    def close(self) -> None:
+        with self._lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
@@ -1,6 +1,48 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import csv
+import io
+import json
+from multiprocessing import Pool
+import os
+import pickle
+import tempfile
+import time
 import unittest
+import unittest.mock
 
-from tasks import DataAnalyzingTask
+from aggregation import DRY_CONDITIONS, Metric, MetricSet
+from benchmark import run_benchmark
+from cache import ForecastCache
+from fetcher import AsyncHTTPClient, fetch_forecasts
+from forecast import CityForecast
+from forecasting import forecast_weather
+from export import ResultExporter
+from fixture_server import RESPONSE_PATH, FixtureServer
+from metrics import RunReport
+from ranking import CityRanking
+from registry import CityRegistry
+from resilience import FetchPolicy
+from service import ForecastService
+from store import AggregateStore
+from stream_parser import parse_forecasts
+from tasks import (DataAggregationTask, DataAnalyzingTask,
+                   DataCalculationTask, DataFetchingTask,
+                   ShardedAnalyzingTask, WeatherPipeline, average_city,
+                   count_city, parallel_map)
+from utils import CITIES, YandexWeatherAPI
+from vectorized import count_metrics_vectorized, np
+
+
+def load_response():
+    with open(RESPONSE_PATH) as file:
+        return json.load(file)['forecasts']
+
+
+def load_forecasts():
+    return CityForecast.from_forecasts(load_response())
 
 
 class TestOutput(unittest.TestCase):
@@ -11,5 +53,655 @@ class TestOutput(unittest.TestCase):
         self.assertEqual(city, 'BEIJING')
 
 
+class TestAsyncFetching(unittest.TestCase):
+    def test_async_fetch_collects_all_cities(self):
+        with FixtureServer() as server:
+            dft = DataFetchingTask(mode='async', limit=3,
+                                   cities=server.city_urls(CITIES))
+            dft.collect_data()
+        data = dft.get_data()
+        self.assertEqual(set(data), set(CITIES))
+        self.assertEqual(data['MOSCOW'].dates[0], '2022-05-18')
+        self.assertEqual(server.requests, len(CITIES))
+
+    def test_async_fetch_skips_unreachable_city(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            urls['NOWHERE'] = 'http://127.0.0.1:1/nowhere.json'
+            dft = DataFetchingTask(mode='async', cities=urls, timeout=2)
+            dft.collect_data()
+        self.assertEqual(list(dft.get_data()), ['MOSCOW'])
+
+    def test_client_reuses_connections(self):
+        async def fetch_many(url):
+            async with AsyncHTTPClient(limit=3) as client:
+                await asyncio.gather(*(client.get(url) for _ in range(30)))
+                return client.connections_opened
+
+        with FixtureServer() as server:
+            opened = asyncio.run(fetch_many(server.url + '/moscow.json'))
+        self.assertLessEqual(opened, 3)
+
+    def test_chunked_response_size(self):
+        async def read(raw):
+            reader = asyncio.StreamReader()
+            reader.feed_data(raw)
+            reader.feed_eof()
+            return await AsyncHTTPClient._read_response(reader, None)
+
+        body = b'x' * 1500
+        raw = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+               + b'400\r\n' + body[:1024] + b'\r\n'
+               + b'1dc\r\n' + body[1024:] + b'\r\n0\r\n\r\n')
+        response, keep_alive = asyncio.run(read(raw))
+        self.assertEqual(response.body, body)
+        self.assertEqual(response.size, 1500)
+        self.assertTrue(keep_alive)
+
+
+class TestResilience(unittest.TestCase):
+    def test_server_errors_are_retried(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            server.script(urls['MOSCOW'], [(500, 0), (503, 0)])
+            policy = FetchPolicy(retries=2, backoff=0.01)
+            data = asyncio.run(fetch_forecasts(urls, policy=policy))
+        self.assertIn('MOSCOW', data)
+        self.assertEqual(server.requests, 3)
+
+    def test_unexpected_errors_are_reported(self):
+        report = RunReport()
+        error = asyncio.LimitOverrunError('header line is too long', 0)
+        with FixtureServer() as server, unittest.mock.patch(
+                'fetcher.resilient_get', side_effect=error):
+            urls = server.city_urls(['MOSCOW', 'PARIS'])
+            data = asyncio.run(fetch_forecasts(urls, report=report))
+        self.assertEqual(data, {})
+        self.assertEqual(set(report.failed), {'MOSCOW', 'PARIS'})
+        self.assertIn('LimitOverrunError', report.failed['MOSCOW'])
+
+    def test_default_fetching_is_resilient(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            server.script(urls['MOSCOW'], [(500, 0)])
+            dft = DataFetchingTask(cities=urls, policy=FetchPolicy(
+                retries=1, backoff=0.01))
+            dft.report = RunReport()
+            dft.collect_data()
+        self.assertIn('MOSCOW', dft.get_data())
+        self.assertEqual(server.requests, 2)
+        self.assertGreater(dft.report.counters['bytes_fetched'], 0)
+        self.assertIn('parse', dft.report.stages)
+
+    def test_deadline_flags_slow_city(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW', 'PARIS', 'LONDON'])
+            server.script(urls['PARIS'], [(200, 3)])
+            report = RunReport()
+            start = time.perf_counter()
+            data = asyncio.run(fetch_forecasts(
+                urls, report=report,
+                policy=FetchPolicy(deadline=0.5, hedge_percentile=None)))
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 2)
+        self.assertEqual(set(data), {'MOSCOW', 'LONDON'})
+        self.assertEqual(report.failed, {'PARIS': 'deadline exceeded'})
+        self.assertTrue(report.as_dict()['partial'])
+
+    def test_slow_request_is_hedged(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            server.script(urls['MOSCOW'], [(200, 3)])
+            policy = FetchPolicy(hedge_min_samples=5)
+            policy.latencies.extend([0.05] * 5)
+            start = time.perf_counter()
+            data = asyncio.run(fetch_forecasts(urls, policy=policy))
+            elapsed = time.perf_counter() - start
+        self.assertIn('MOSCOW', data)
+        self.assertEqual(policy.hedges, 1)
+        self.assertLess(elapsed, 2)
+
+    def test_open_circuit_fails_fast(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW', 'PARIS'])
+            server.script(urls['MOSCOW'], [(500, 0)] * 3)
+            policy = FetchPolicy(retries=2, backoff=0.01,
+                                 breaker_threshold=3, breaker_reset=60)
+            report = RunReport()
+            asyncio.run(fetch_forecasts({'MOSCOW': urls['MOSCOW']},
+                                        report=report, policy=policy))
+            data = asyncio.run(fetch_forecasts({'PARIS': urls['PARIS']},
+                                               report=report, policy=policy))
+        self.assertEqual(data, {})
+        self.assertIn('circuit open', report.failed['PARIS'])
+        self.assertEqual(server.requests, 3)
+
+
+class TestForecastCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_warm_run_does_no_network_io(self):
+        cache = ForecastCache(self.tmp.name)
+        ywapi = YandexWeatherAPI(cache)
+        with FixtureServer() as server:
+            url = server.city_urls(['MOSCOW'])['MOSCOW']
+            first = ywapi._do_cached_req(url)
+            second = ywapi._do_cached_req(url)
+        self.assertEqual(first, second)
+        self.assertEqual(server.requests, 1)
+
+    def test_stale_entry_is_revalidated(self):
+        cache = ForecastCache(self.tmp.name, ttl=0)
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            asyncio.run(fetch_forecasts(urls, cache=cache))
+            data = asyncio.run(fetch_forecasts(urls, cache=cache))
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(data['MOSCOW'].dates[0], '2022-05-18')
+        entry = cache.get(urls['MOSCOW'])
+        self.assertIn('If-None-Match', entry.validators())
+
+    def test_evicts_by_size(self):
+        cache = ForecastCache(self.tmp.name, max_bytes=1000)
+        cache.put('http://a', b'x' * 600)
+        cache.put('http://b', b'y' * 600)
+        self.assertIsNone(cache.get('http://a'))
+        self.assertEqual(cache.get('http://b').body, b'y' * 600)
+        self.assertFalse([name for name in os.listdir(self.tmp.name)
+                          if name.endswith('.tmp')])
+
+    def test_put_scans_directory_only_to_evict(self):
+        cache = ForecastCache(self.tmp.name, max_bytes=20000)
+        with unittest.mock.patch.object(cache, '_scan',
+                                        wraps=cache._scan) as scan:
+            for i in range(50):
+                cache.put(f'http://city{i}', b'x' * 300)
+        self.assertEqual(scan.call_count, 1)
+        self.assertLessEqual(cache.total, 20000)
+        self.assertEqual(ForecastCache(self.tmp.name).total, cache.total)
+
+    def test_concurrent_puts_keep_size_exact(self):
+        cache = ForecastCache(self.tmp.name, max_bytes=10 ** 6)
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(
+                lambda i: cache.put(f'http://city{i % 40}', b'x' * (i % 7)),
+                range(400)))
+        self.assertEqual(cache.total, ForecastCache(self.tmp.name).total)
+        clone = pickle.loads(pickle.dumps(cache))
+        clone.put('http://other', b'y')
+        self.assertEqual(clone.total, ForecastCache(self.tmp.name).total)
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestVectorizedEngine(unittest.TestCase):
+    def test_matches_python_engine(self):
+        rainy = load_response()
+        for hour in rainy[0]['hours']:
+            hour['condition'] = 'light-rain'
+            hour['temp'] += 3
+        raw_data = {'MOSCOW': load_forecasts(),
+                    'PARIS': CityForecast.from_forecasts(rainy)}
+        dct = DataCalculationTask()
+        dct.raw_data = raw_data
+        dct.counted_data = {}
+        expected = dct.count_av_temp(['MOSCOW', 'PARIS'])
+        result = count_metrics_vectorized(raw_data, ['MOSCOW', 'PARIS'],
+                                          dct.metrics)
+        self.assertEqual(result, expected)
+
+    def test_matches_python_engine_for_custom_metrics(self):
+        metrics = MetricSet(WIND_METRICS, days=(1, 4))
+        raw_data = {'MOSCOW': CityForecast.from_forecasts(load_response(),
+                                                          metrics.fields)}
+        self.assertEqual(
+            count_metrics_vectorized(raw_data, ['MOSCOW'], metrics),
+            {'MOSCOW': metrics.count_days(raw_data['MOSCOW'])})
+
+
+WIND_METRICS = (
+    Metric('temp', hours=(12, 16)),
+    Metric('wind', 'wind_speed', 'max', hours=(0, 24)),
+    Metric('humidity', 'humidity', 'min'),
+    Metric('rain', 'prec_prob', 'sum', hours=(6, 22)),
+    Metric('dry', 'condition', 'count', conditions=DRY_CONDITIONS,
+           digits=None),
+)
+
+
+class TestMetricSet(unittest.TestCase):
+    def test_divides_by_hours_with_data(self):
+        forecast = CityForecast.from_forecasts(
+            [{'date': '2022-05-18',
+              'hours': [{'temp': 0, 'condition': 'rain'}] * 9
+              + [{'temp': 10, 'condition': 'clear'},
+                 {'temp': 20, 'condition': 'rain'}]},
+             {'date': '2022-05-19', 'hours': []}])
+        days = MetricSet().count_days(forecast)
+        self.assertEqual(days, {'2022-05-18': {'temp': 15.0, 'hours': 1},
+                                '2022-05-19': {'temp': None, 'hours': None}})
+        self.assertEqual(MetricSet().average(days), (15.0, 1.0))
+
+    def test_extra_fields_and_day_range(self):
+        metrics = MetricSet(WIND_METRICS, days=(0, 2))
+        forecasts = load_response()
+        model = CityForecast.from_forecasts(forecasts, metrics.fields)
+        days = metrics.count_days(model)
+        self.assertEqual(list(days), ['2022-05-18', '2022-05-19'])
+        hours = forecasts[1]['hours']
+        self.assertEqual(days['2022-05-19']['wind'],
+                         round(max(hour['wind_speed'] for hour in hours), 1))
+        self.assertEqual(days['2022-05-19']['rain'],
+                         sum(hour['prec_prob'] for hour in hours[6:22]))
+
+    def test_configurable_ranking(self):
+        dat = DataAggregationTask(metrics=MetricSet(
+            WIND_METRICS, rank_by=('-wind', 'temp')))
+        ranked = dat.sort_cities({'A': (20, 9, 50, 0, 5),
+                                  'B': (10, 3, 50, 0, 5),
+                                  'C': (25, 3, 50, 0, 5),
+                                  'D': (30, None, 50, 0, 5)})
+        self.assertEqual(list(ranked), ['C', 'B', 'A', 'D'])
+        with self.assertRaises(ValueError):
+            MetricSet(WIND_METRICS, rank_by=('pressure',))
+
+    def test_pipeline_exports_configured_metrics(self):
+        with tempfile.TemporaryDirectory() as tmp, FixtureServer() as server:
+            pipeline = WeatherPipeline(server.city_urls(['MOSCOW', 'PARIS']),
+                                       stream=True,
+                                       metrics=MetricSet(WIND_METRICS))
+            path = os.path.join(tmp, 'data.csv')
+            dant = pipeline.analyze(path=path, formats=('csv',))
+            with open(path, encoding='UTF8') as file:
+                rows = file.read().splitlines()
+        self.assertEqual(len(rows), 1 + 2 * len(WIND_METRICS))
+        self.assertEqual(len(dant.choose_best().split()), 2)
+
+
+class TestCityRanking(unittest.TestCase):
+    def setUp(self):
+        self.ranking = CityRanking(MetricSet().rank_key)
+        for city, average in [('A', (10, 5)), ('B', (20, 1)), ('C', (20, 1)),
+                              ('D', (15, 3)), ('E', (5, 9))]:
+            self.ranking.update(city, average)
+
+    def test_top_and_tie_groups(self):
+        self.assertEqual(self.ranking.leaders(), ['B', 'C'])
+        self.assertEqual([city for city, _ in self.ranking.top(1)], ['B'])
+        self.assertEqual([city for city, _ in self.ranking.top(3)],
+                         ['B', 'C', 'D'])
+        self.assertEqual(list(self.ranking.ordered()),
+                         ['B', 'C', 'D', 'A', 'E'])
+
+    def test_leaders_share_first_metric(self):
+        self.ranking.update('F', (20, 7))
+        self.assertEqual(self.ranking.leaders(), ['F', 'B', 'C'])
+        self.assertEqual([city for city, _ in self.ranking.top(1, True)],
+                         ['F'])
+
+    def test_incremental_updates(self):
+        self.assertFalse(self.ranking.update('A', (10, 5)))
+        self.assertTrue(self.ranking.update('E', (30, 0)))
+        self.ranking.discard('B')
+        self.assertEqual(self.ranking.leaders(), ['E'])
+        self.assertEqual(list(self.ranking.ordered()), ['E', 'C', 'D', 'A'])
+        for step in range(200):
+            self.ranking.update('A', (step, 0))
+        self.assertEqual(self.ranking.leaders(), ['A'])
+        self.assertLess(len(self.ranking._heap), 100)
+        self.assertEqual(len(self.ranking), 4)
+
+
+class TestParallelMap(unittest.TestCase):
+    def test_pool_matches_in_process(self):
+        forecasts = load_forecasts()
+        items = [(f'CITY{i}', forecasts) for i in range(20)]
+        in_process = dict(parallel_map(count_city, items))
+        pooled = dict(parallel_map(count_city, items, chunksize=3,
+                                   min_parallel=0))
+        self.assertEqual(pooled, in_process)
+        self.assertEqual(in_process['CITY0']['2022-05-18'],
+                         DataCalculationTask.count_city_days(forecasts)[
+                             '2022-05-18'])
+
+    def test_average_city(self):
+        days = {'2022-05-18': {'temp': 10, 'hours': 4},
+                '2022-05-19': {'temp': 13, 'hours': 7}}
+        self.assertEqual(average_city(('MOSCOW', days)),
+                         ('MOSCOW', (11.5, 5.5)))
+
+
+class TestStageGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_each_stage_runs_once(self):
+        with FixtureServer() as server:
+            dft = DataFetchingTask(mode='async',
+                                   cities=server.city_urls(CITIES))
+            dant = DataAnalyzingTask(fetching=dft)
+            dant.collect_data()
+            dant.save_to_csv()
+            best = dant.choose_best()
+        self.assertEqual(server.requests, len(CITIES))
+        self.assertEqual(best.split(), list(CITIES))
+        with open('data.csv', encoding='UTF8') as file:
+            self.assertEqual(len(file.readlines()), 1 + 2 * len(CITIES))
+
+
+class TestIncrementalRecomputation(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'aggregates.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_pipeline(self, raw_data):
+        store = AggregateStore(self.path)
+        counted = DataCalculationTask(store=store).calculate(raw_data)
+        average = DataAggregationTask(store=store).aggregate(counted)
+        return store, counted, average
+
+    def test_only_changed_cities_are_recalculated(self):
+        forecasts = load_forecasts()
+        raw_data = {'MOSCOW': forecasts, 'PARIS': copy.deepcopy(forecasts)}
+        self.run_pipeline(raw_data)
+        store, _, first = self.run_pipeline(raw_data)
+        self.assertEqual(set(store.entries), {'MOSCOW', 'PARIS'})
+        raw_data['PARIS'].temps[10] += 20
+        with unittest.mock.patch.object(
+                DataCalculationTask, 'count_city_days',
+                wraps=DataCalculationTask.count_city_days) as count:
+            _, counted, second = self.run_pipeline(raw_data)
+        self.assertEqual(count.call_count, 1)
+        self.assertEqual(second['MOSCOW'], first['MOSCOW'])
+        self.assertEqual(second['PARIS'][0],
+                         round(first['PARIS'][0] + 20 / 11 / 3, 1))
+        self.assertEqual(counted['PARIS']['2022-05-18']['temp'],
+                         DataCalculationTask.count_city_days(
+                             raw_data['PARIS'])['2022-05-18']['temp'])
+
+    def test_average_follows_days_not_calculating_task(self):
+        forecasts = load_forecasts()
+        self.run_pipeline({'MOSCOW': forecasts})
+        forecasts.temps[10] += 20
+        counted = DataCalculationTask().calculate({'MOSCOW': forecasts})
+        store = AggregateStore(self.path)
+        average = DataAggregationTask(store=store).aggregate(counted)
+        expected = DataAggregationTask().aggregate(counted)
+        self.assertEqual(average, expected)
+
+    def test_pipeline_uses_store(self):
+        store = AggregateStore(self.path)
+        with FixtureServer() as server, \
+                WeatherPipeline(store=store) as pipeline:
+            urls = server.city_urls(['MOSCOW', 'PARIS'])
+            first = pipeline.analyze(urls)
+            with unittest.mock.patch.object(
+                    DataCalculationTask, 'count_city_days') as count:
+                second = pipeline.analyze(urls)
+        count.assert_not_called()
+        self.assertEqual(second.get_sorted_cities(),
+                         first.get_sorted_cities())
+        self.assertEqual(AggregateStore(self.path).entries, store.entries)
+
+
+class TestWeatherPipeline(unittest.TestCase):
+    def test_concurrent_analyses_do_not_share_state(self):
+        with FixtureServer(variants=16) as server, \
+                WeatherPipeline(min_parallel=3, processes=2) as pipeline:
+            first = server.city_urls(f'A{i}' for i in range(6))
+            second = server.city_urls(['B0', 'B1'])
+            with ThreadPoolExecutor() as executor:
+                runs = list(executor.map(pipeline.analyze,
+                                         [first, second] * 3))
+            again = pipeline.analyze(first)
+        for dant, urls in zip(runs, [first, second] * 3):
+            self.assertEqual(set(dant.get_sorted_cities()), set(urls))
+            self.assertEqual(len(dant.aggregation.dates), 5)
+        self.assertEqual(again.get_sorted_cities(),
+                         runs[0].get_sorted_cities())
+
+
+class TestForecastService(unittest.TestCase):
+    def test_periodic_refresh_keeps_connections_warm(self):
+        with FixtureServer(variants=16) as server:
+            urls = server.city_urls(f'CITY{i}' for i in range(6))
+            pipeline = WeatherPipeline(urls, limit=10)
+            with pipeline, \
+                    ForecastService(pipeline, interval=0.05) as service:
+                first = service.snapshot
+                deadline = time.time() + 10
+                while service.refreshes < 3 and time.time() < deadline:
+                    time.sleep(0.02)
+                latest = service.snapshot
+                opened = service.client.connections_opened
+        self.assertGreaterEqual(service.refreshes, 3)
+        self.assertIsNot(first, latest)
+        self.assertEqual(first.top(len(urls)), latest.top(len(urls)))
+        self.assertEqual(first.report['counters']['cities_reranked'],
+                         len(urls))
+        self.assertEqual(latest.report['counters']['cities_reranked'], 0)
+        self.assertEqual(latest.rank(latest.top(1)[0][0]), 1)
+        self.assertLessEqual(opened, len(urls))
+        self.assertGreaterEqual(server.requests, 3 * len(urls))
+
+    def test_failed_first_refresh_is_raised(self):
+        pipeline = WeatherPipeline({'MOSCOW': 'http://127.0.0.1:1/'})
+        service = ForecastService(pipeline, interval=0.05)
+        with unittest.mock.patch.object(
+                pipeline, 'analyze', side_effect=RuntimeError('broken')):
+            with self.assertRaisesRegex(RuntimeError, 'broken'):
+                service.start(timeout=10)
+        self.assertIsNone(service.snapshot)
+        self.assertIsNone(service._thread)
+
+    def test_stop_leaves_callers_pipeline_open(self):
+        with FixtureServer() as server:
+            urls = server.city_urls(['MOSCOW'])
+            with WeatherPipeline(urls, min_parallel=1,
+                                 processes=1) as pipeline:
+                with ForecastService(pipeline, interval=60):
+                    pool = pipeline.pool
+                self.assertIs(pipeline.pool, pool)
+                self.assertIsNotNone(pool)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        days = {'2022-05-18': {'temp': 10.5, 'hours': 4},
+                '2022-05-19': {'temp': 13.0, 'hours': 7}}
+        self.records = [('MOSCOW', 'Москва', days, (11.8, 5.5), 1),
+                        ('PARIS', 'Париж', {'2022-05-18': days['2022-05-18']},
+                         (10.5, 4.0), 2)]
+        self.exporter = ResultExporter(['18-05', '19-05'], batch_size=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_csv(self):
+        path = os.path.join(self.tmp.name, 'data.csv')
+        self.exporter.write(path, self.records)
+        with open(path, encoding='UTF8') as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[1], 'Москва,"Температура, среднее",'
+                                   '10.5,13.0,11.8,1')
+        self.assertEqual(len(lines), 5)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_npz_loads_with_numpy(self):
+        path = os.path.join(self.tmp.name, 'data.npz')
+        self.exporter.write(path, self.records, 'npz')
+        with np.load(path) as npz:
+            self.assertEqual(npz['cities'].tolist(), ['MOSCOW', 'PARIS'])
+            self.assertEqual(npz['temp'].shape, (2, 2))
+            self.assertTrue(np.isnan(npz['temp'][1, 1]))
+            self.assertEqual(npz['hours'][0].tolist(), [4, 7])
+            self.assertEqual(npz['rank'].tolist(), [1, 2])
+
+
+class TestCityForecast(unittest.TestCase):
+    def test_round_trip(self):
+        forecasts = load_response()
+        model = CityForecast.from_forecasts(forecasts)
+        self.assertEqual(model.dates, [day['date'] for day in forecasts])
+        self.assertEqual(model.to_forecasts()[0]['hours'][:2],
+                         [{'temp': hour['temp'],
+                           'condition': hour['condition']}
+                          for hour in forecasts[0]['hours'][:2]])
+        self.assertEqual(pickle.loads(pickle.dumps(model)), model)
+
+    def test_missing_and_unknown_hour_fields(self):
+        model = CityForecast.from_forecasts(
+            [{'date': '2022-05-18', 'hours': [{'condition': 'fog'}]}])
+        self.assertEqual(model.to_forecasts(),
+                         [{'date': '2022-05-18',
+                           'hours': [{'temp': None, 'condition': None}]}])
+
+    def test_is_much_smaller_than_response(self):
+        forecasts = load_response()
+        model = CityForecast.from_forecasts(forecasts)
+        self.assertLess(len(pickle.dumps(model)) * 10,
+                        len(pickle.dumps(forecasts)))
+
+
+class TestStreamParser(unittest.TestCase):
+    def test_extracts_only_used_fields(self):
+        with open(RESPONSE_PATH, 'rb') as file:
+            raw = file.read()
+        expected = CityForecast.from_forecasts(json.loads(raw)['forecasts'])
+        for chunk_size in (1, 7, 4096):
+            forecasts = parse_forecasts(io.BytesIO(raw), chunk_size)
+            self.assertEqual(forecasts, expected)
+
+    def test_incomplete_document(self):
+        with self.assertRaises(ValueError):
+            parse_forecasts(io.BytesIO(b'{"forecasts": [{"date": "2022'))
+
+    def test_async_stream_fetch(self):
+        with FixtureServer() as server:
+            dft = DataFetchingTask(mode='async', stream=True,
+                                   cities=server.city_urls(['MOSCOW']))
+            dft.collect_data()
+        forecast = dft.get_data()['MOSCOW'].to_forecasts()[0]
+        self.assertEqual(set(forecast), {'date', 'hours'})
+        self.assertEqual(forecast['hours'][0],
+                         {'temp': 10, 'condition': 'overcast'})
+
+
+class TestShardedRun(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_registry_from_csv(self):
+        path = os.path.join(self.tmp.name, 'cities.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('name,url,title\nA,http://a,Эй\nB,http://b,\n'
+                       'C,http://c,Си\n')
+        registry = CityRegistry.load(path)
+        self.assertEqual(registry.titles, {'A': 'Эй', 'B': 'B', 'C': 'Си'})
+        self.assertEqual([list(shard) for shard in registry.shards(2)],
+                         [['A', 'B'], ['C']])
+
+    def test_plain_run_uses_registry(self):
+        path = os.path.join(self.tmp.name, 'cities.json')
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        with FixtureServer(variants=2) as server:
+            urls = server.city_urls(['FIRST', 'SECOND'])
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump([{'name': name, 'url': url, 'title': name.title()}
+                           for name, url in urls.items()], file)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                forecast_weather(path)
+        best = output.getvalue().splitlines()[0].split()
+        self.assertTrue(set(best) <= set(urls))
+        with open('data.csv', encoding='UTF8') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(len(rows), 1 + 2 * len(urls))
+        self.assertEqual({row[0] for row in rows[1::2]}, {'First', 'Second'})
+
+    def test_sharded_run_writes_every_city(self):
+        path = os.path.join(self.tmp.name, 'data.csv')
+        names = [f'CITY{i}' for i in range(23)]
+        with FixtureServer() as server:
+            urls = server.city_urls(names)
+            registry = CityRegistry(urls, {name: name for name in names})
+            dant = ShardedAnalyzingTask(registry, shard_size=5,
+                                        processes=2, path=path,
+                                        formats=('csv', 'npz'))
+            dant.collect_data()
+            dant.save_to_csv()
+        with open(path, encoding='UTF8') as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0].split(',')[2], '18-05')
+        self.assertEqual(len(lines), 1 + 2 * len(names))
+        self.assertEqual(len(dant.choose_best().split()), len(names))
+        self.assertFalse(os.path.exists(path + '.part'))
+        self.assertTrue(os.path.exists(path[:-len('csv')] + 'npz'))
+        self.assertEqual(list(dant.get_sorted_cities()),
+                         list(dant.aggregation.ranking.ordered()))
+
+    def test_sharded_run_reports_failed_cities(self):
+        path = os.path.join(self.tmp.name, 'data.csv')
+        names = [f'CITY{i}' for i in range(6)]
+        with FixtureServer() as server:
+            urls = server.city_urls(names)
+            urls['LOST'] = 'http://127.0.0.1:1/lost-response.json'
+            registry = CityRegistry(urls, {name: name for name in urls})
+            dant = ShardedAnalyzingTask(registry, shard_size=3,
+                                        processes=2, path=path)
+            dant.collect_data()
+        self.assertEqual(set(dant.report.failed), {'LOST'})
+        self.assertEqual(len(dant.get_sorted_cities()), len(names))
+        self.assertGreater(dant.report.counters['bytes_fetched'],
+                           len(names) * 20000)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_benchmark_reports_every_stage(self):
+        result = run_benchmark(cities=20, repeat=1)
+        report = result['runs'][0]
+        self.assertEqual(set(report['stages']),
+                         {'fetch', 'parse', 'calculate', 'aggregate',
+                          'rank', 'export'})
+        self.assertEqual(report['counters']['cities_processed'], 20)
+        self.assertGreater(report['counters']['bytes_fetched'], 20 * 20000)
+        self.assertIsNone(report['pool_utilization'])
+        json.dumps(result)
+
+    def test_pool_utilization(self):
+        report = RunReport()
+        items = [(f'CITY{i}', load_forecasts()) for i in range(8)]
+        parallel_map(count_city, items, chunksize=2, min_parallel=0,
+                     report=report)
+        utilization = report.as_dict()['pool_utilization']
+        self.assertTrue(0 < utilization <= 1)
+
+    def test_shared_pool_utilization(self):
+        report = RunReport()
+        items = [(f'CITY{i}', load_forecasts()) for i in range(8)]
+        with Pool(2) as pool:
+            parallel_map(count_city, items, chunksize=2, min_parallel=0,
+                         report=report, pool=pool, processes=2)
+        utilization = report.as_dict()['pool_utilization']
+        self.assertTrue(0 < utilization <= 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,31 +1,22 @@
 import logging
 import sys
 import json
+from typing import Optional
+
+from cache import ForecastCache
+from registry import CityRegistry
+from stream_parser import ForecastStreamParser, parse_forecasts
 
 if sys.version_info[0] == 3:
-    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
 else:
     from urllib import urlopen
 
 logger = logging.getLogger()
 
-CITIES = {
-    "MOSCOW": "https://code.s3.yandex.net/async-module/moscow-response.json",
-    "PARIS": "https://code.s3.yandex.net/async-module/paris-response.json",
-    "LONDON": "https://code.s3.yandex.net/async-module/london-response.json",
-    "BERLIN": "https://code.s3.yandex.net/async-module/berlin-response.json",
-    "BEIJING": "https://code.s3.yandex.net/async-module/beijing-response.json",
-    "KAZAN": "https://code.s3.yandex.net/async-module/kazan-response.json",
-    "SPETERSBURG": "https://code.s3.yandex.net/async-module/spetersburg-response.json",
-    "VOLGOGRAD": "https://code.s3.yandex.net/async-module/volgograd-response.json",
-    "NOVOSIBIRSK": "https://code.s3.yandex.net/async-module/novosibirsk-response.json",
-    "KALININGRAD": "https://code.s3.yandex.net/async-module/kaliningrad-response.json",
-    "ABUDHABI": "https://code.s3.yandex.net/async-module/abudhabi-response.json",
-    "WARSZAWA": "https://code.s3.yandex.net/async-module/warszawa-response.json",
-    "BUCHAREST": "https://code.s3.yandex.net/async-module/bucharest-response.json",
-    "ROMA": "https://code.s3.yandex.net/async-module/roma-response.json",
-    "CAIRO": "https://code.s3.yandex.net/async-module/cairo-response.json",
-}
+REGISTRY = CityRegistry.load()
+CITIES = REGISTRY.urls
 ERR_MESSAGE_TEMPLATE = "Something wrong. Please connect with administrator."
 
 
@@ -34,12 +25,45 @@ class YandexWeatherAPI:
         Base class for requests
     """
 
+    def __init__(self, cache: Optional[ForecastCache] = None,
+                 stream: bool = False, timeout: Optional[float] = None,
+                 fields=()):
+        """
+        :param cache: opt-in on-disk cache of responses
+        :param stream: parse only forecasts[].date,
+            forecasts[].hours[].temp/condition and the hour fields
+            listed in fields incrementally
+        :param timeout: socket timeout of a single request in seconds
+        """
+        self.cache = cache
+        self.stream = stream
+        self.timeout = timeout
+        self.fields = tuple(fields)
+
+    def _loads(self, body):
+        if not self.stream:
+            return json.loads(body)
+        parser = ForecastStreamParser(self.fields)
+        parser.feed(body)
+        return {"forecasts": parser.close()}
+
+    @staticmethod
+    def _do_stream_req(url, timeout=None, fields=()):
+        """ Request method that never holds the whole response """
+
+        try:
+            with urlopen(url, timeout=timeout) as req:
+                return {"forecasts": parse_forecasts(req, fields=fields)}
+        except Exception as ex:
+            logger.error(ex)
+            raise Exception(ERR_MESSAGE_TEMPLATE)
+
     @staticmethod
-    def _do_req(url, method="GET"):
+    def _do_req(url, method="GET", timeout=None):
         """ Base request method """
 
         try:
-            with urlopen(url) as req:
+            with urlopen(url, timeout=timeout) as req:
                 resp = req.read().decode("utf-8")
                 resp = json.loads(resp)
             if req.status != 200:
@@ -53,6 +77,31 @@ class YandexWeatherAPI:
             logger.error(ex)
             raise Exception(ERR_MESSAGE_TEMPLATE)
 
+    def _do_cached_req(self, url):
+        """ Request through the cache: fresh entries are served without
+        network I/O, stale ones are revalidated with ETag/Last-Modified """
+        entry = self.cache.get(url)
+        if entry is not None and entry.is_fresh(self.cache.ttl):
+            return self._loads(entry.body)
+        headers = entry.validators() if entry is not None else {}
+        try:
+            with urlopen(Request(url, headers=headers),
+                         timeout=self.timeout) as req:
+                body = req.read()
+                resp_headers = dict(req.headers.items())
+        except HTTPError as ex:
+            if ex.code == 304 and entry is not None:
+                self.cache.touch(entry)
+                return self._loads(entry.body)
+            logger.error(ex)
+            raise Exception(ERR_MESSAGE_TEMPLATE)
+        except Exception as ex:
+            logger.error(ex)
+            raise Exception(ERR_MESSAGE_TEMPLATE)
+        resp = self._loads(body)
+        self.cache.put(url, body, resp_headers)
+        return resp
+
     @staticmethod
     def _get_url_by_city_name(city_name):
         city_url = CITIES.get(city_name, None)
@@ -66,4 +115,16 @@ class YandexWeatherAPI:
         :return: response data as json
         """
         city_url = self._get_url_by_city_name(city_name)
-        return self._do_req(city_url)
+        return self.get_forecasting_by_url(city_url)
+
+    def get_forecasting_by_url(self, city_url):
+        """
+        :param city_url: forecast url from the city registry
+        :return: response data as json
+        """
+        if self.cache is not None:
+            return self._do_cached_req(city_url)
+        if self.stream:
+            return self._do_stream_req(city_url, timeout=self.timeout,
+                                       fields=self.fields)
+        return self._do_req(city_url, timeout=self.timeout)
@@ -0,0 +1,116 @@
+import logging
+import math
+from typing import Iterable, Optional
+
+from aggregation import Metric, MetricSet
+from forecast import CONDITION_CODES, NO_CONDITION, CityForecast
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HOURS_PER_DAY = 24
+
+
+class ForecastArrays:
+    """Почасовые прогнозы всех городов в плотных массивах:
+    строка – день одного города, столбец – час; columns – массивы
+    дополнительных полей часа той же формы"""
+
+    def __init__(self, temps, conditions, days: list[tuple[str, str]],
+                 codes: dict[str, int], columns: Optional[dict] = None):
+        self.temps = temps
+        self.conditions = conditions
+        self.days = days
+        self.codes = codes
+        self.columns = columns or {}
+
+    def column(self, field: str):
+        if field == 'temp':
+            return self.temps
+        if field == 'condition':
+            return self.conditions
+        return self.columns[field]
+
+
+def pack_forecasts(raw_data: dict[str, CityForecast],
+                   cities: Iterable[str], fields: Iterable[str] = (),
+                   days: tuple[int, Optional[int]] = (0, None)
+                   ) -> ForecastArrays:
+    """Раскладывает почасовые массивы CityForecast по строкам-дням
+    массива температур (float) и массива кодов погодных условий (int8);
+    fields – дополнительные поля, days – срез дней каждого города"""
+    if np is None:
+        raise RuntimeError('numpy is required for the vectorized engine')
+    packed_days = []
+    spans = []
+    for city in cities:
+        try:
+            forecast = raw_data[city]
+        except KeyError:
+            msg = f'no such city: {city}'
+            logging.error(msg)
+            continue
+        for index in range(len(forecast))[slice(*days)]:
+            packed_days.append((city, forecast.dates[index]))
+            spans.append((forecast, index))
+    shape = (len(spans), HOURS_PER_DAY)
+    temps = np.full(shape, np.nan)
+    conditions = np.full(shape, NO_CONDITION, dtype=np.int8)
+    columns = {field: np.full(shape, np.nan) for field in fields}
+    for row, (forecast, index) in enumerate(spans):
+        start = forecast.offsets[index]
+        stop = min(forecast.offsets[index + 1], start + HOURS_PER_DAY)
+        temps[row, :stop - start] = forecast.temps[start:stop]
+        conditions[row, :stop - start] = forecast.conditions[start:stop]
+        for field, column in columns.items():
+            values = forecast.columns.get(field)
+            if values is not None:
+                column[row, :stop - start] = values[start:stop]
+    return ForecastArrays(temps, conditions, packed_days, CONDITION_CODES,
+                          columns)
+
+
+def reduce_metric(metric: Metric, packed: ForecastArrays):
+    """Значения показателя по всем строкам-дням, nan – нет данных"""
+    first, last = metric.hours
+    window = packed.column(metric.field)[:, first:last]
+    if metric.how == 'count':
+        known = (window != NO_CONDITION).sum(axis=1)
+        values = np.isin(window, list(metric.codes)).sum(axis=1)
+        return np.where(known > 0, values, np.nan)
+    missing = np.isnan(window)
+    known = (~missing).sum(axis=1)
+    if metric.how in ('mean', 'sum'):
+        values = np.where(missing, 0.0, window).sum(axis=1)
+        if metric.how == 'mean':
+            values = values / np.maximum(known, 1)
+    elif metric.how == 'min':
+        values = np.where(missing, np.inf, window).min(axis=1)
+    else:
+        values = np.where(missing, -np.inf, window).max(axis=1)
+    return np.where(known > 0, values, np.nan)
+
+
+def count_metrics_vectorized(raw_data: dict[str, CityForecast],
+                             cities: Iterable[str],
+                             metrics: MetricSet) -> dict[str, dict]:
+    """Аналог MetricSet.count_days для всех городов сразу: каждый
+    показатель считается одной операцией по массиву всех дней"""
+    packed = pack_forecasts(raw_data, cities, metrics.fields, metrics.days)
+    columns = [(metric, reduce_metric(metric, packed).tolist())
+               for metric in metrics.metrics]
+    counted_data = {}
+    for row, (city, date) in enumerate(packed.days):
+        day = {}
+        for metric, values in columns:
+            value = values[row]
+            if math.isnan(value):
+                day[metric.name] = None
+            elif metric.how == 'count':
+                day[metric.name] = int(value)
+            else:
+                day[metric.name] = metric.round(value)
+        counted_data.setdefault(city, {})[date] = day
+    return counted_data
@@ -0,0 +1,83 @@
+import asyncio
+import ssl
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+
+class Response(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def text(self, encoding: str = 'utf-8') -> str:
+        return self.body.decode(encoding, errors='replace')
+
+
+async def fetch(url: str, timeout: Optional[float] = 30.0) -> Response:
+    """GET-запрос на соединении asyncio без сторонних библиотек;
+    перенаправления не выполняются"""
+    return await asyncio.wait_for(_get(url), timeout)
+
+
+async def _get(url: str) -> Response:
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError(f'unsupported url: {url}')
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port,
+        ssl=ssl.create_default_context() if https else None)
+    try:
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        writer.write((f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                      f'User-Agent: scheduler\r\nAccept-Encoding: identity'
+                      f'\r\nConnection: close\r\n\r\n').encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await _read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+        return Response(status, headers, body)
+    finally:
+        writer.close()
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if not size:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+    return b''.join(chunks)
+
+
+async def read_file(path: str, mode: str = 'r'):
+    """Чтение файла; блокирующий вызов выполняется в потоке
+    по умолчанию, цикл в это время свободен"""
+    def read():
+        with open(path, mode) as file:
+            return file.read()
+    return await asyncio.get_running_loop().run_in_executor(None, read)
+
+
+async def write_file(path: str, data, mode: str = 'w') -> None:
+    """Запись файла, как и чтение, вне цикла"""
+    def write():
+        with open(path, mode) as file:
+            file.write(data)
+    await asyncio.get_running_loop().run_in_executor(None, write)
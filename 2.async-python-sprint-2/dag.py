@@ -0,0 +1,118 @@
+from typing import Dict, List, Tuple
+
+from job import DONE, FINISHED, PENDING, SKIPPED, Job
+
+
+class CycleError(ValueError):
+    """Зависимости задач образуют цикл"""
+
+
+class JobGraph:
+    """Граф зависимостей поставленных задач. Задача готова к запуску,
+    когда завершились все её зависимости; после успешного завершения
+    задачи сразу освобождаются зависящие от неё, после неудачи все её
+    потомки пропускаются"""
+
+    def __init__(self):
+        self.waiting: Dict[Job, int] = {}
+        self.dependents: Dict[Job, List[Job]] = {}
+
+    def __contains__(self, job: Job) -> bool:
+        return job in self.dependents
+
+    @staticmethod
+    def topological_order(job: Job) -> List[Job]:
+        """Задача и все её ещё не запускавшиеся зависимости так, что
+        зависимости идут раньше зависящих; обход итеративный, поэтому
+        длина цепочки не ограничена глубиной рекурсии"""
+        order: List[Job] = []
+        done = set()
+        path = set()
+        stack: List[Tuple[Job, int]] = [(job, 0)]
+        path.add(job)
+        while stack:
+            current, index = stack.pop()
+            deps = [dep for dep in current.dependencies
+                    if dep.status == PENDING]
+            if index < len(deps):
+                stack.append((current, index + 1))
+                dep = deps[index]
+                if dep in path:
+                    chain = [item.command for item, _ in stack] + [
+                        dep.command]
+                    raise CycleError('dependency cycle: '
+                                     + ' -> '.join(chain))
+                if dep not in done:
+                    path.add(dep)
+                    stack.append((dep, 0))
+                continue
+            path.discard(current)
+            done.add(current)
+            order.append(current)
+        return order
+
+    def add(self, job: Job) -> Tuple[List[Job], List[Job], List[Job]]:
+        """Регистрирует задачу вместе с незарегистрированными
+        зависимостями; возвращает новые задачи, готовые к запуску
+        и пропущенные из-за неудачных зависимостей"""
+        if job in self.dependents or job.status != PENDING:
+            return [], [], []
+        new = [item for item in self.topological_order(job)
+               if item not in self.dependents]
+        ready: List[Job] = []
+        skipped: List[Job] = []
+        for item in new:
+            self.dependents[item] = []
+            count = 0
+            failed = False
+            for dep in item.dependencies:
+                if dep.status == DONE:
+                    continue
+                if dep in self.dependents and dep.status not in FINISHED:
+                    self.dependents[dep].append(item)
+                    count += 1
+                else:
+                    failed = True
+            if failed:
+                item.status = SKIPPED
+                skipped.append(item)
+            elif count:
+                self.waiting[item] = count
+            else:
+                ready.append(item)
+        for item in skipped:
+            skipped.extend(self._skip_dependents(item))
+        return new, ready, skipped
+
+    def complete(self, job: Job) -> Tuple[List[Job], List[Job]]:
+        """Отмечает завершение задачи; возвращает освободившиеся задачи
+        и пропущенных потомков, если задача завершилась неудачно"""
+        if job.status != DONE:
+            return [], self._skip_dependents(job)
+        ready = []
+        for dependent in self.dependents.pop(job, []):
+            if dependent not in self.waiting:
+                # уже пропущена из-за другой зависимости
+                continue
+            self.waiting[dependent] -= 1
+            if not self.waiting[dependent]:
+                del self.waiting[dependent]
+                ready.append(dependent)
+        return ready, []
+
+    def _skip_dependents(self, job: Job) -> List[Job]:
+        skipped = []
+        stack = self.dependents.pop(job, [])
+        while stack:
+            dependent = stack.pop()
+            self.waiting.pop(dependent, None)
+            if dependent.status != PENDING:
+                continue
+            dependent.status = SKIPPED
+            skipped.append(dependent)
+            stack.extend(self.dependents.pop(dependent, []))
+        return skipped
+
+    def blocked(self) -> List[Job]:
+        """Задачи, которые ещё ждут зависимостей"""
+        return list(self.waiting)
@@ -1,81 +1,430 @@
+import asyncio
+import functools
+import importlib
+import inspect
 import json
 import logging
 import os
-from threading import Condition, Thread
-from typing import List, TypeVar
+import random
+import signal
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import (Any, Callable, List, NamedTuple, Optional, TypeVar,
+                    Union)
 import time
 import uuid
 
 T = TypeVar('T')
 
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+CANCELLED = 'cancelled'
+PLANNED = 'planned'
+FINISHED = frozenset((DONE, FAILED, SKIPPED, CANCELLED, PLANNED))
+
+
+def parse_start(start_at: Union[str, datetime]) -> Optional[float]:
+    """Время запуска в секундах эпохи: datetime или строка ISO 8601,
+    пустое значение – запускать сразу"""
+    if not start_at:
+        return None
+    if not isinstance(start_at, datetime):
+        start_at = datetime.fromisoformat(start_at)
+    return start_at.timestamp()
+
+
+@functools.lru_cache(maxsize=None)
+def boot_id() -> Optional[str]:
+    """Идентификатор текущей загрузки системы; None, если его
+    нельзя узнать"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def process_start(pid: int) -> Optional[int]:
+    """Время запуска процесса в тиках от загрузки системы (поле 22
+    /proc/<pid>/stat); None, если процесса нет или /proc недоступен"""
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # имя команды в скобках может содержать пробелы и скобки
+    fields = stat.rpartition(')')[2].split()
+    return int(fields[19]) if len(fields) > 19 else None
+
+
+class RetryPolicy(NamedTuple):
+    """Задержка перед повтором после attempt неудачных запусков:
+    base * factor ** (attempt - 1), но не больше max_delay, со случайным
+    отклонением до ±jitter от неё, чтобы повторы не приходили разом"""
+
+    base: float = 1.0
+    factor: float = 2.0
+    max_delay: float = 60.0
+    jitter: float = 0.1
+
+    def delay(self, attempt: int) -> float:
+        try:
+            delay = min(self.max_delay,
+                        self.base * self.factor ** min(attempt - 1, 64))
+        except OverflowError:
+            # рост задержки уже упёрся в max_delay
+            delay = self.max_delay
+        delay *= 1 + self.jitter * (2 * random.random() - 1)
+        return max(0.0, min(self.max_delay, delay))
+
 
 class Job:
-    def __init__(self, command: str, start_at: str = "",
+    """Команда оболочки, выполняемая асинхронным подпроцессом.
+    max_working_time – предел длительности одного запуска в секундах
+    (-1 – без ограничения): по его истечении группе процессов задачи
+    отправляется SIGTERM, а через kill_timeout секунд – SIGKILL.
+    start_at – время запуска (datetime или строка ISO 8601).
+    tries – число повторов после неудачного запуска, их расписание –
+    retry (по умолчанию – политика планировщика), итоги всех запусков –
+    в history. attempts – число завершённых запусков, pid – группа
+    процессов текущего запуска, pid_start – время запуска её лидера,
+    по которому после сбоя её можно отличить от чужого процесса с тем
+    же pid; on_spawn вызывается после запуска подпроцесса"""
+
+    kill_timeout = 5.0
+
+    def __init__(self, command: str, start_at: Union[str, datetime] = "",
                  max_working_time: int = -1, tries: int = 0,
-                 dependencies: List[T] = []):
+                 dependencies: List[T] = [],
+                 retry: Optional[RetryPolicy] = None):
+        self.id = uuid.uuid4().hex
         self.command = command
         self.start_at = start_at
+        self.start_time = parse_start(start_at)
         self.max_working_time = max_working_time
         self.tries = tries
+        self.retry = retry
+        self.retry_at: Optional[float] = None
         self.dependencies = dependencies
+        self.status = PENDING
+        self.exit_code: Optional[int] = None
+        self.signal: Optional[int] = None
+        self.duration: Optional[float] = None
+        self.timed_out = False
+        self.error: Optional[BaseException] = None
+        self.attempts = 0
+        self.history: List[dict] = []
+        self.pid: Optional[int] = None
+        self.pid_start: Optional[int] = None
+        self.on_spawn: Optional[Callable[['Job'], None]] = None
 
-    def run(self):
-        code = 0
-        start = time.time()
-        for i in range(self.tries):
-            coro = self.run_coro()
-            next(coro)
-            code = coro.send(self.command)
-            coro.close()
-            if code == 0:
-                break
-        if time.time() - start > self.max_working_time > -1:
+    async def run(self) -> None:
+        """Один запуск задачи с записью его итога в history;
+        повтор после неудачи планирует планировщик"""
+        self.error = None
+        self.exit_code = self.signal = self.duration = None
+        try:
+            code = await self.execute()
+        except Exception as ex:
+            self.attempts += 1
+            self.error = ex
             code = 1
-        tag = 'done' if code == 0 else 'fwe'
-        self.write_to_file(tag)
-
-    def run_with_dependencies(self):
-        cond = Condition()
-        t1 = Thread(target=self.run_dep, args=(self.dependencies[0], cond))
-        t2 = Thread(target=self.run_main, args=(self.command, cond))
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.start()
-
-    def run_coro(self):
-        while True:
-            try:
-                cmd = (yield)
-                code = os.system(cmd)
-                yield code
-            except GeneratorExit:
-                logging.info('корутина закончилась')
-                raise
-
-    def run_dep(self, job, cond: Condition):
-        cond.acquire()
-        os.system(job.command)
-        cond.release()
-
-    def run_main(self, cmd: str, cond: Condition):
-        cond.acquire()
-        os.system(cmd)
-        cond.release()
+            msg = f'Задача {self.command} не запустилась: {ex!r}'
+            logging.error(msg)
+        failed = code != 0 or self.timed_out
+        self.history.append({
+            'attempt': self.attempts, 'exit_code': self.exit_code,
+            'signal': self.signal, 'timed_out': self.timed_out,
+            'duration': self.duration,
+            'error': repr(self.error) if self.error else None})
+        self.status = FAILED if failed else DONE
+
+    async def execute(self) -> int:
+        """Один запуск команды; возвращает код завершения,
+        для убитого сигналом процесса – отрицательный номер сигнала"""
+        start = time.monotonic()
+        self.timed_out = False
+        proc = await asyncio.create_subprocess_shell(
+            self.command, start_new_session=True)
+        self.pid = proc.pid
+        self.pid_start = process_start(proc.pid)
+        if self.on_spawn is not None:
+            self.on_spawn(self)
+        timeout = self.max_working_time if self.max_working_time > -1 \
+            else None
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            msg = (f'Задача {self.command} превысила {timeout} с '
+                   f'и будет остановлена')
+            logging.warning(msg)
+            await self.stop(proc)
+        except asyncio.CancelledError:
+            await self.stop(proc)
+            raise
+        self.duration = time.monotonic() - start
+        self.attempts += 1
+        self.pid = self.pid_start = None
+        code = proc.returncode
+        self.exit_code = code if code >= 0 else None
+        self.signal = -code if code < 0 else None
+        msg = (f'Задача {self.command} завершилась: код {self.exit_code}, '
+               f'сигнал {self.signal}, {self.duration:.3f} с')
+        logging.info(msg)
+        return code
+
+    async def stop(self, proc: asyncio.subprocess.Process) -> None:
+        """SIGTERM группе процессов задачи, затем SIGKILL"""
+        self.kill_group(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), self.kill_timeout)
+        except asyncio.TimeoutError:
+            self.kill_group(proc, signal.SIGKILL)
+            await proc.wait()
+
+    @staticmethod
+    def kill_group(proc: asyncio.subprocess.Process, sig: int) -> None:
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
 
     def get_dependencies(self):
         return self.dependencies
 
-    def write_to_file(self, tag: str):
-        """Запись задачи в файл"""
-        name = str(uuid.uuid1())
-        name += '.json'
-        path = f'{tag}/{name}'
-        text = {'command': self.command}
-        if self.max_working_time:
-            text['max_working_time'] = self.max_working_time
-        if self.tries:
-            text['tries'] = self.tries
-        jsn = json.dumps(text)
-        with open(path, 'w') as file:
-            file.write(jsn)
+    def to_dict(self) -> dict:
+        """Состояние задачи для журнала"""
+        start_at = self.start_at.isoformat() \
+            if isinstance(self.start_at, datetime) else self.start_at
+        return {'id': self.id, 'command': self.command,
+                'start_at': start_at,
+                'max_working_time': self.max_working_time,
+                'tries': self.tries, 'attempts': self.attempts,
+                'retry': self.retry, 'retry_at': self.retry_at,
+                'history': self.history, 'pid': self.pid,
+                'pid_start': self.pid_start,
+                'boot_id': boot_id() if self.pid is not None else None,
+                'dependencies': [job.id for job in self.dependencies],
+                'status': self.status, 'exit_code': self.exit_code,
+                'signal': self.signal, 'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Job':
+        """Задача из записи журнала; зависимости восстанавливает
+        планировщик по их id"""
+        job = cls(data['command'], data.get('start_at', ''),
+                  data.get('max_working_time', -1), data.get('tries', 0))
+        job.restore(data)
+        return job
+
+    def restore(self, data: dict) -> None:
+        """Восстанавливает из записи журнала состояние запусков;
+        успешно завершённая задача остаётся завершённой"""
+        self.id = data['id']
+        if data.get('status') == DONE:
+            self.status = DONE
+        self.attempts = data.get('attempts', 0)
+        self.history = data.get('history', [])
+        self.retry_at = data.get('retry_at')
+        if data.get('retry'):
+            self.retry = RetryPolicy(*data['retry'])
+
+
+def target_name(func: Callable) -> str:
+    """Имя функции вида модуль:имя для записи в журнал"""
+    return f'{func.__module__}:{func.__qualname__}'
+
+
+def import_target(name: str) -> Callable:
+    module, _, qualname = name.partition(':')
+    target: Any = importlib.import_module(module)
+    for attr in qualname.split('.'):
+        target = getattr(target, attr)
+    return target
+
+
+class CallableJob(Job):
+    """Вызов функции Python в пуле процессов планировщика
+    (pool='process') или в пуле потоков (pool='thread') – для функций,
+    ждущих ввода-вывода. Задачи среди аргументов становятся
+    зависимостями и при запуске заменяются своими результатами.
+    Результат вызова – в result, исключение – в error; результат,
+    представимый в JSON, сохраняется в журнале для зависящих задач.
+    По истечении max_working_time задача считается неудачной, но вызов
+    в пуле не прерывается"""
+
+    kind = 'call'
+    pools = ('process', 'thread')
+
+    def __init__(self, func: Callable, *args, pool: str = 'process',
+                 start_at: Union[str, datetime] = "",
+                 max_working_time: int = -1, tries: int = 0,
+                 dependencies: List[T] = [],
+                 retry: Optional[RetryPolicy] = None, **kwargs):
+        if pool not in self.pools:
+            raise ValueError(f'unknown pool: {pool}')
+        dependencies = list(dependencies)
+        for value in (*args, *kwargs.values()):
+            if isinstance(value, Job) and value not in dependencies:
+                dependencies.append(value)
+        super().__init__(target_name(func), start_at, max_working_time,
+                         tries, dependencies, retry)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.pool = pool
+        self.result: Any = None
+        self.executor: Optional[Executor] = None
+
+    async def execute(self) -> int:
+        """Один вызов функции; 0 – успех, 1 – исключение или превышение
+        времени"""
+        start = time.monotonic()
+        self.timed_out = False
+        self.error = None
+        timeout = self.max_working_time if self.max_working_time > -1 \
+            else None
+        code = 1
+        try:
+            call = functools.partial(
+                self.func, *map(self._resolve, self.args),
+                **{key: self._resolve(value)
+                   for key, value in self.kwargs.items()})
+            self.result = await asyncio.wait_for(self._call(call), timeout)
+            code = 0
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            msg = f'Задача {self.command} превысила {timeout} с'
+            logging.warning(msg)
+        except Exception as ex:
+            self.error = ex
+            msg = f'Задача {self.command} завершилась с ошибкой: {ex!r}'
+            logging.error(msg)
+        self.duration = time.monotonic() - start
+        self.attempts += 1
+        self.exit_code = code
+        msg = (f'Задача {self.command} завершилась: код {code}, '
+               f'{self.duration:.3f} с')
+        logging.info(msg)
+        return code
+
+    async def _call(self, call: functools.partial) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, call)
+
+    def _resolve(self, value: Any) -> Any:
+        """Результат задачи-аргумента; после восстановления из журнала
+        аргумент хранит только id задачи"""
+        if isinstance(value, Job):
+            return getattr(value, 'result', None)
+        if isinstance(value, dict) and set(value) == {'$job'}:
+            for job in self.dependencies:
+                if job.id == value['$job']:
+                    return self._resolve(job)
+            raise LookupError(f'result of job {value["$job"]} is lost')
+        return value
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data.update(kind=self.kind, pool=self.pool, args=None, kwargs=None)
+        args = [self._encode(value) for value in self.args]
+        kwargs = {key: self._encode(value)
+                  for key, value in self.kwargs.items()}
+        if self.status == DONE and self._serializable(self.result):
+            data['result'] = self.result
+        if not self._serializable([args, kwargs]):
+            # такие аргументы не переживут перезапуск
+            return data
+        data.update(args=args, kwargs=kwargs)
+        return data
+
+    @staticmethod
+    def _serializable(value: Any) -> bool:
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def _encode(value: Any) -> Any:
+        return {'$job': value.id} if isinstance(value, Job) else value
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'CallableJob':
+        if data.get('args') is None:
+            raise ValueError('arguments were not saved')
+        job = cls(import_target(data['command']), *data['args'],
+                  pool=data['pool'], start_at=data.get('start_at', ''),
+                  max_working_time=data.get('max_working_time', -1),
+                  tries=data.get('tries', 0), **data['kwargs'])
+        job.restore(data)
+        return job
+
+    def restore(self, data: dict) -> None:
+        super().restore(data)
+        if self.status == DONE:
+            if 'result' not in data:
+                raise ValueError('result was not saved')
+            self.result = data['result']
+
+
+class CoroutineJob(CallableJob):
+    """Функция async def или генератор, выполняемые прямо на цикле
+    планировщика. Генератор отдаёт awaitable в точках ввода-вывода
+    и получает обратно результат или исключение, None – просто уступить
+    цикл; возвращённое значение становится результатом. Такие задачи
+    не занимают мест pool_size, их число ограничено отдельно, а
+    max_working_time действительно прерывает выполнение"""
+
+    kind = 'coro'
+    pools = ('loop',)
+
+    def __init__(self, func: Callable, *args, **kwargs):
+        if not (inspect.iscoroutinefunction(func)
+                or inspect.isgeneratorfunction(func)):
+            raise ValueError(f'{target_name(func)} is neither a coroutine '
+                             f'nor a generator function')
+        kwargs.setdefault('pool', 'loop')
+        super().__init__(func, *args, **kwargs)
+
+    async def _call(self, call: functools.partial) -> Any:
+        result = call()
+        if inspect.isgenerator(result):
+            return await self._drive(result)
+        return await result
+
+    @staticmethod
+    async def _drive(gen) -> Any:
+        """Выполняет генератор до возврата значения"""
+        value: Any = None
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                try:
+                    step = gen.send(value) if error is None \
+                        else gen.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                value, error = None, None
+                try:
+                    if step is None:
+                        await asyncio.sleep(0)
+                    else:
+                        value = await step
+                except Exception as ex:
+                    error = ex
+        finally:
+            gen.close()
+
+
+def load_job(data: dict) -> Job:
+    """Задача из записи журнала нужного вида"""
+    kinds = {job.kind: job for job in (CallableJob, CoroutineJob)}
+    if data.get('kind') in kinds:
+        return kinds[data['kind']].from_dict(data)
+    return Job.from_dict(data)
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List
+
+from job import DONE, PLANNED, FINISHED
+
+TERMINAL = FINISHED - {PLANNED}
+
+
+class Journal:
+    """Журнал состояния задач: каждая запись – полное состояние задачи,
+    дописывается в journal.log. Записи копятся в буфере и сбрасываются
+    на диск пачкой с одним fsync (групповая фиксация). После
+    snapshot_every записей действующие задачи сохраняются в
+    snapshot.json, а журнал начинается заново, поэтому восстановление
+    читает снимок из незавершённых задач и хвост журнала, но не всю
+    историю. Успешно завершённая задача остаётся в состоянии, пока на
+    неё ссылаются незавершённые, чтобы после перезапуска они получили
+    её результат"""
+
+    journal_name = 'journal.log'
+    snapshot_name = 'snapshot.json'
+
+    def __init__(self, path: str = 'state', snapshot_every: int = 10000):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.state: Dict[str, dict] = {}
+        # число незавершённых задач, зависящих от задачи с этим id
+        self.refs: Dict[str, int] = {}
+        self.written = 0
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._file = None
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.path, self.journal_name)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.path, self.snapshot_name)
+
+    @property
+    def pending(self) -> bool:
+        """В буфере есть незафиксированные записи"""
+        with self._lock:
+            return bool(self._buffer)
+
+    def recover(self) -> Dict[str, dict]:
+        """Читает снимок и журнал; возвращает незавершённые задачи
+        по id и открывает журнал для записи"""
+        state: Dict[str, dict] = {}
+        try:
+            with open(self.snapshot_path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            pass
+        refs: Dict[str, int] = {}
+        for record in state.values():
+            if record['status'] not in TERMINAL:
+                self._reference(refs, record, 1)
+        replayed = 0
+        try:
+            with open(self.journal_path) as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        msg = 'Журнал обрывается на неполной записи'
+                        logging.warning(msg)
+                        break
+                    self._apply(state, refs, record)
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.state = state
+            self.refs = refs
+        msg = (f'Восстановлено задач: {len(state)}, '
+               f'записей журнала: {replayed}')
+        logging.info(msg)
+        self.snapshot()
+        return dict(state)
+
+    def append(self, record: dict) -> bool:
+        """Добавляет запись в буфер; True, если буфер был пуст и нужно
+        запланировать фиксацию"""
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._apply(self.state, self.refs, record)
+            self._buffer.append(line)
+            return len(self._buffer) == 1
+
+    def commit(self) -> int:
+        """Записывает накопленные записи одним fsync; возвращает их
+        число. При необходимости делает снимок"""
+        with self._io_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            file = self._open()
+            file.write('\n'.join(batch) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+            self.written += len(batch)
+            if self.written >= self.snapshot_every:
+                self._snapshot()
+            return len(batch)
+
+    def snapshot(self) -> None:
+        """Сохраняет действующие задачи и начинает журнал заново"""
+        with self._io_lock:
+            self._snapshot()
+
+    def close(self) -> None:
+        self.commit()
+        self.snapshot()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _snapshot(self) -> None:
+        # записи состояния не изменяются, а заменяются целиком, поэтому
+        # под замком достаточно копии словаря, а сериализация идёт без
+        # него и не задерживает запись из цикла событий
+        with self._lock:
+            state = dict(self.state)
+        text = json.dumps(state, separators=(',', ':'))
+        temp = self.snapshot_path + '.tmp'
+        with open(temp, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.snapshot_path)
+        # записи журнала уже вошли в снимок; повторное применение
+        # после сбоя между заменой и усечением ничего не меняет
+        self._open().truncate(0)
+        self.written = 0
+        self._sync_dir()
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.journal_path, 'a')
+        return self._file
+
+    def _sync_dir(self) -> None:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def _apply(cls, state: Dict[str, dict], refs: Dict[str, int],
+               record: dict) -> None:
+        key = record['id']
+        previous = state.get(key)
+        if record['status'] not in TERMINAL:
+            if previous is None:
+                cls._reference(refs, record, 1)
+            state[key] = record
+            return
+        if previous is not None and previous['status'] not in TERMINAL:
+            for dep in cls._reference(refs, previous, -1):
+                # зависимость больше никому не нужна
+                if state.get(dep, {}).get('status') == DONE:
+                    del state[dep]
+        if record['status'] == DONE and refs.get(key):
+            state[key] = record
+        else:
+            state.pop(key, None)
+
+    @staticmethod
+    def _reference(refs: Dict[str, int], record: dict,
+                   delta: int) -> List[str]:
+        """Изменяет счётчики ссылок на зависимости записи; возвращает
+        зависимости, на которые больше не ссылаются"""
+        released = []
+        for dep in record.get('dependencies', ()):
+            refs[dep] = refs.get(dep, 0) + delta
+            if refs[dep] <= 0:
+                del refs[dep]
+                released.append(dep)
+        return released
@@ -1,6 +1,6 @@
 from scheduler import Scheduler
 
 if __name__ == '__main__':
-    scheduler = Scheduler()
-    job = scheduler.new('touch t.txt')
-    scheduler.run(job)
+    with Scheduler() as scheduler:
+        job = scheduler.new('touch t.txt')
+        scheduler.run(job)
@@ -1,36 +1,152 @@
-import json
+import asyncio
 import logging
 import os
-from typing import List, TypeVar
+import signal
+import threading
+import time
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from typing import Dict, Iterable, List, Optional, Set, TypeVar
 
-from job import Job
+from dag import JobGraph
+from job import (CANCELLED, DONE, FAILED, FINISHED, PENDING, PLANNED, RUNNING,
+                 CallableJob, CoroutineJob, Job, RetryPolicy, boot_id,
+                 load_job, process_start)
+from journal import Journal
+from timers import TimerQueue
 
 T = TypeVar('T')
 
 
 class Scheduler:
-    count_tasks = 0
-    dir_names = ['done', 'planned', 'fwe']
+    """Планировщик на цикле событий asyncio в фоновом потоке:
+    одновременно выполняется не больше pool_size задач, следующая
+    ожидающая задача запускается, как только освобождается место.
+    Задача попадает в очередь, когда успешно завершились все её
+    зависимости; при неудаче зависимости она пропускается. Задачи
+    с будущим start_at ждут в очереди таймеров, диспетчер спит до
+    ближайшего срабатывания. Переходы задач записываются в журнал
+    в каталоге state_dir. Функции CallableJob выполняются в общих
+    пулах: процессов на workers процессов и потоков на pool_size
+    потоков. CoroutineJob выполняются на самом цикле, одновременно –
+    не больше coroutines; у них своя очередь и свой диспетчер, поэтому
+    они не ждут мест пулов за задачами оболочки. Неудачный запуск
+    повторяется не сразу, а через задержку по политике retry задачи
+    или планировщика: задача уходит в очередь таймеров, и её место
+    занимают другие"""
 
-    def __init__(self, pool_size: int = 10):
-        self.jobs = []
-        self.pending = []
+    def __init__(self, pool_size: int = 10, state_dir: str = 'state',
+                 workers: Optional[int] = None, coroutines: int = 10000,
+                 retry: RetryPolicy = RetryPolicy()):
+        self.jobs: List[Job] = []
+        self.submitted: List[Job] = []
         self.pool_size = pool_size
-        self.create_dirs()
+        self.workers = workers
+        self.coroutines = coroutines
+        self.retry = retry
+        self.count_tasks = 0
+        self._executors: Dict[str, Executor] = {}
+        self._graph = JobGraph()
+        self._journal = Journal(state_dir)
+        self._timers = TimerQueue()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._light: Optional[asyncio.Queue] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dirty: Optional[asyncio.Event] = None
+        self._closing = False
+        self._drain = True
         self.restart()
 
-    def schedule(self, task):
-        pass
+    def __enter__(self) -> 'Scheduler':
+        return self
 
-    def run(self, job: Job):
-        if self.count_tasks < 10:
-            if job.dependencies:
-                job.run_with_dependencies()
-            else:
-                job.run()
-        else:
-            self.pending.append(job)
-            job.write_to_file('planned')
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+
+    def schedule(self, task: Job) -> Job:
+        return self.submit(task)
+
+    def submit(self, job: Job) -> Job:
+        """Ставит задачу вместе с ещё не поставленными зависимостями,
+        не дожидаясь её выполнения; CycleError, если зависимости
+        образуют цикл"""
+        if self._closing:
+            raise RuntimeError('scheduler is shut down')
+        self._start()
+        with self._cond:
+            new, ready, skipped = self._graph.add(job)
+            self.submitted.extend(new)
+            for item in new:
+                self._record(item)
+                # запись завершённой зависимости остаётся в журнале,
+                # пока задача её ждёт, и хранит нужный ей результат
+                for dep in item.dependencies:
+                    if dep.status == DONE:
+                        self._record(dep)
+            self._skipped(skipped)
+            ready = self._delay(ready)
+        for item in ready:
+            self._loop.call_soon_threadsafe(self._enqueue, item)
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Отменяет ещё не наступившую отложенную задачу, её потомки
+        пропускаются; False, если задача не ждёт своего времени"""
+        with self._cond:
+            if not self._timers.cancel(job):
+                return False
+            job.status = CANCELLED
+            self._record(job)
+            _, skipped = self._graph.complete(job)
+            self._skipped(skipped)
+            self._cond.notify_all()
+        msg = f'Задача {job.command} отменена'
+        logging.info(msg)
+        return True
+
+    def timer_stats(self) -> dict:
+        """Точность запуска отложенных задач"""
+        with self._cond:
+            return self._timers.stats()
+
+    def run(self, job: Job) -> None:
+        """Выполняет задачу и ждёт её завершения"""
+        self.submit(job)
+        self.wait([job])
+
+    def wait(self, jobs: Optional[Iterable[Job]] = None,
+             timeout: Optional[float] = None) -> bool:
+        """Ждёт завершения задач (по умолчанию – всех поставленных);
+        False, если за timeout секунд они не завершились"""
+        with self._cond:
+            waited = list(jobs) if jobs is not None else list(self.submitted)
+
+            def finished() -> bool:
+                # завершённые задачи больше не проверяются
+                while waited and waited[-1].status in FINISHED:
+                    waited.pop()
+                return not waited
+
+            return self._cond.wait_for(finished, timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Останавливает планировщик. При wait дожидается всех
+        готовых к запуску задач, иначе – только выполняемых; ожидающие,
+        в том числе отложенные, сохраняются в журнале для
+        восстановления при следующем запуске"""
+        self._drain = wait
+        self._closing = True
+        if self._thread is None:
+            self._journal.close()
+            return
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self._thread = None
 
     def new(self, command: str, start_at: str = "",
             max_working_time: int = -1, tries: int = 0,
@@ -40,22 +156,270 @@ class Scheduler:
         self.jobs.append(job)
         return job
 
-    def create_dirs(self):
-        """Создаёт директории для файлов задач"""
-        for name in self.dir_names:
-            cmd = f'mkdir {name}'
-            code = os.system(cmd)
-            if code != 0:
-                msg = f'Директория {name} уже создана'
-                logging.info(msg)
-
     def restart(self):
-        """Восстанавливает задачи из файлов задач при перезапуске"""
-        for filename in os.listdir('planned'):
-            with open(os.path.join('planned', filename)) as file:
-                data = json.load(file)
-                tries = data.get('tries', 0)
-                max_working_time = data.get('max_working_time', -1)
-                job = Job(data['command'], tries=tries,
-                          max_working_time=max_working_time)
-                self.jobs.append(job)
+        """Восстанавливает незавершённые задачи из журнала вместе
+        с зависимостями, временем запуска и числом запусков и сразу
+        ставит их на выполнение. Прерванные запуски начинаются заново,
+        оставшиеся от них группы процессов завершаются"""
+        records = self._journal.recover()
+        jobs = {key: self._restore(data) for key, data in records.items()}
+        for key, data in records.items():
+            job = jobs[key]
+            # завершённые зависимости из журнала уже удалены
+            job.dependencies = [jobs[dep] for dep in data['dependencies']
+                                if dep in jobs]
+            if data['status'] == RUNNING:
+                self._reclaim(job, data)
+        self.jobs.extend(jobs.values())
+        for job in jobs.values():
+            if job.status not in FINISHED:
+                self.submit(job)
+
+    def _restore(self, data: dict) -> Job:
+        """Задача из журнала; задача, которую нельзя восстановить,
+        считается неудачной, и её потомки будут пропущены"""
+        try:
+            return load_job(data)
+        except (ImportError, AttributeError, ValueError) as ex:
+            msg = (f'Задачу {data["command"]} не удалось восстановить: '
+                   f'{ex!r}')
+            logging.error(msg)
+        job = Job.from_dict(data)
+        job.status = FAILED
+        self._record(job)
+        return job
+
+    @staticmethod
+    def _reclaim(job: Job, data: dict) -> None:
+        """Завершает группу процессов запуска, прерванного сбоем, если
+        её лидер ещё жив: совпадают загрузка системы и время запуска
+        процесса с этим pid. Иначе pid мог достаться чужому процессу,
+        и группа не трогается"""
+        msg = f'Задача {job.command} была прервана и будет перезапущена'
+        logging.warning(msg)
+        pid = data.get('pid')
+        if pid is None:
+            return
+        if (data.get('boot_id') is None
+                or data.get('boot_id') != boot_id()
+                or data.get('pid_start') is None
+                or data.get('pid_start') != process_start(pid)):
+            msg = (f'Процесс {pid} задачи {job.command} уже завершён, '
+                   f'группа не завершается')
+            logging.warning(msg)
+            return
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=asyncio.run,
+                                            args=(self._serve(),),
+                                            daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    async def _serve(self) -> None:
+        """Запускает диспетчеры задач оболочки и функций в пулах
+        (pool_size мест) и задач на цикле (coroutines мест) и ждёт
+        останова"""
+        self._queue = asyncio.Queue()
+        self._light = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._dirty = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        # записи, добавленные до появления цикла (например, при
+        # восстановлении), не разбудили фиксацию
+        if self._journal.pending:
+            self._dirty.set()
+        running: Set[asyncio.Task] = set()
+        unstarted: List[Job] = []
+        dispatchers = [
+            asyncio.create_task(self._dispatch(
+                queue, asyncio.Semaphore(size), running, unstarted))
+            for queue, size in ((self._queue, self.pool_size),
+                                (self._light, self.coroutines))]
+        timers = asyncio.create_task(self._fire_timers())
+        committer = asyncio.create_task(self._commit_journal())
+        self._started.set()
+        await self._stopping.wait()
+        if self._drain:
+            await self._drained(running)
+        for queue in (self._queue, self._light):
+            queue.put_nowait(None)
+        await asyncio.gather(*dispatchers)
+        timers.cancel()
+        if running:
+            await asyncio.gather(*running)
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._save_pending(unstarted)
+        committer.cancel()
+        self._journal.close()
+        stats = self.timer_stats()
+        if stats['fired']:
+            msg = (f'Отложенных задач запущено: {stats["fired"]}, '
+                   f'опоздание среднее {stats["mean_lateness"]:.4f} с, '
+                   f'максимальное {stats["max_lateness"]:.4f} с')
+            logging.info(msg)
+
+    async def _dispatch(self, queue: asyncio.Queue,
+                        limit: asyncio.Semaphore, running: Set[asyncio.Task],
+                        unstarted: List[Job]) -> None:
+        """Диспетчер одной очереди: берёт задачу, как только
+        освобождается одно из мест limit; None в очереди – останов"""
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            await limit.acquire()
+            if self._closing and not self._drain:
+                limit.release()
+                unstarted.append(job)
+                return
+            task = asyncio.create_task(self._execute(job, limit))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+    def _enqueue(self, job: Job) -> None:
+        """Ставит готовую задачу в очередь её диспетчера"""
+        queue = self._light if isinstance(job, CoroutineJob) else self._queue
+        queue.put_nowait(job)
+
+    async def _fire_timers(self) -> None:
+        """Переносит наступившие отложенные задачи в очередь и спит
+        до следующего срабатывания или добавления более ранней задачи"""
+        while True:
+            with self._cond:
+                due, delay = self._timers.pop_due(time.time())
+            for job in due:
+                self._enqueue(job)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _commit_journal(self) -> None:
+        """Групповая фиксация журнала: пока идёт fsync одной пачки,
+        записи копятся для следующей"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            await loop.run_in_executor(None, self._journal.commit)
+
+    def _record(self, job: Job) -> None:
+        """Под блокировкой: записывает состояние задачи в журнал;
+        до запуска цикла фиксацию будит _serve"""
+        if self._journal.append(job.to_dict()) and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dirty.set)
+
+    def _executor(self, pool: str) -> Executor:
+        """Общий пул для функций, создаётся при первой задаче"""
+        if pool not in self._executors:
+            self._executors[pool] = ProcessPoolExecutor(self.workers) \
+                if pool == 'process' else ThreadPoolExecutor(self.pool_size)
+        return self._executors[pool]
+
+    def _retry(self, job: Job) -> bool:
+        """Под блокировкой: возвращает неудачную задачу с оставшимися
+        повторами в ожидание до времени повтора"""
+        if job.status != FAILED or job.attempts > job.tries:
+            return False
+        delay = (job.retry or self.retry).delay(job.attempts)
+        job.status = PENDING
+        job.retry_at = time.time() + delay
+        self._record(job)
+        msg = (f'Задача {job.command} будет повторена через {delay:.2f} с '
+               f'(запуск {job.attempts + 1} из {job.tries + 1})')
+        logging.warning(msg)
+        return True
+
+    def _lease(self, job: Job) -> None:
+        """Записывает группу процессов выполняемого запуска задачи"""
+        with self._cond:
+            self._record(job)
+
+    def _delay(self, jobs: List[Job]) -> List[Job]:
+        """Под блокировкой: откладывает задачи с будущим start_at,
+        возвращает остальные"""
+        now = time.time()
+        ready = []
+        for job in jobs:
+            when = job.retry_at or job.start_time
+            if when is None or when <= now:
+                ready.append(job)
+            elif self._timers.push(job, when):
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+        return ready
+
+    async def _drained(self, running: Set[asyncio.Task]) -> None:
+        """Останов с ожиданием: ждёт, пока опустеют обе очереди
+        и завершатся выполняемые задачи, чтобы освобождённые ими
+        зависимые задачи тоже выполнились"""
+        while running or not self._queue.empty() or not self._light.empty():
+            if running:
+                await asyncio.wait(running,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            else:
+                # диспетчеры ещё не взяли задачи из очередей
+                await asyncio.sleep(0)
+
+    async def _execute(self, job: Job, slots: asyncio.Semaphore) -> None:
+        with self._cond:
+            self.count_tasks += 1
+            job.status = RUNNING
+            job.on_spawn = self._lease
+            self._record(job)
+        if isinstance(job, CallableJob) and job.pool != 'loop':
+            job.executor = self._executor(job.pool)
+        msg = f'Задача {job.command} запущена'
+        logging.info(msg)
+        try:
+            await job.run()
+        except Exception as ex:
+            job.status = FAILED
+            msg = f'Задача {job.command} завершилась с ошибкой: {ex!r}'
+            logging.error(msg)
+        finally:
+            slots.release()
+            with self._cond:
+                self.count_tasks -= 1
+                if self._retry(job):
+                    ready = [job]
+                else:
+                    self._record(job)
+                    ready, skipped = self._graph.complete(job)
+                    self._skipped(skipped)
+                ready = self._delay(ready)
+                self._cond.notify_all()
+            for item in ready:
+                self._enqueue(item)
+
+    def _skipped(self, jobs: List[Job]) -> None:
+        for job in jobs:
+            self._record(job)
+            msg = f'Задача {job.command} пропущена: зависимость не выполнена'
+            logging.warning(msg)
+
+    def _save_pending(self, unstarted: List[Job]) -> None:
+        """Отмечает в журнале не запущенные задачи, в том числе
+        отложенные и ещё ждущие зависимостей"""
+        for queue in (self._queue, self._light):
+            while not queue.empty():
+                unstarted.append(queue.get_nowait())
+        with self._cond:
+            unstarted.extend(self._timers.drain())
+            unstarted.extend(self._graph.blocked())
+            for job in unstarted:
+                if job is None:
+                    continue
+                job.status = PLANNED
+                self._record(job)
+            self._cond.notify_all()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Планировщик с журналом во временном каталоге и общий лог,
+    в который команды отмечают начало и конец работы"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state_dir = os.path.join(self.tmp.name, 'state')
+        self.log = os.path.join(self.tmp.name, 'log')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def scheduler(self, **kwargs) -> Scheduler:
+        return Scheduler(state_dir=self.state_dir, **kwargs)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def traced(self, name: str, seconds: float) -> str:
+        return (f'echo start {name} >> {self.log}; sleep {seconds}; '
+                f'echo end {name} >> {self.log}')
+
+    def events(self) -> list:
+        with open(self.log) as file:
+            return [line.split() for line in file]
+
+    def peak(self) -> int:
+        """Наибольшее число одновременно работавших команд"""
+        running = peak = 0
+        for event, _ in self.events():
+            running += 1 if event == 'start' else -1
+            peak = max(peak, running)
+        return peak
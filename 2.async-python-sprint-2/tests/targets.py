@@ -0,0 +1,62 @@
+"""Функции задач для тестов: задачи ссылаются на них по имени модуля,
+поэтому они должны импортироваться в рабочих процессах и после
+перезапуска"""
+import asyncio
+import os
+
+
+def double(value):
+    return value * 2
+
+
+def add(first, second):
+    return first + second
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def fail(message):
+    raise RuntimeError(message)
+
+
+def make_object():
+    return object()
+
+
+# одновременно выполняемые и наибольшее их число для tracked
+active = 0
+peak = 0
+
+
+async def tracked(seconds, value=None):
+    global active, peak
+    active += 1
+    peak = max(peak, active)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        active -= 1
+    return value
+
+
+async def raise_later(message):
+    await asyncio.sleep(0)
+    raise RuntimeError(message)
+
+
+def stepped(values):
+    total = 0
+    for value in values:
+        total += yield asyncio.sleep(0, value)
+        # просто уступить цикл
+        yield
+    return total
+
+
+def recovering(message):
+    try:
+        yield raise_later(message)
+    except RuntimeError as ex:
+        return f'caught {ex}'
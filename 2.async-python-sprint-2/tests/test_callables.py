@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import os
+import unittest
+
+from job import DONE, FAILED, SKIPPED, CallableJob, Job
+from tests import targets
+from tests.helpers import SchedulerTestCase
+
+
+class TestCallableJob(SchedulerTestCase):
+    def test_function_runs_in_process_pool(self):
+        job = CallableJob(targets.worker_pid)
+        with self.scheduler(workers=2) as scheduler:
+            scheduler.run(job)
+        self.assertEqual(job.status, DONE)
+        self.assertNotEqual(job.result, os.getpid())
+        self.assertEqual(job.command, 'tests.targets:worker_pid')
+
+    def test_results_are_passed_to_dependents(self):
+        first = CallableJob(targets.double, 21)
+        second = CallableJob(targets.add, first, second=5, pool='thread')
+        with self.scheduler() as scheduler:
+            scheduler.run(second)
+        self.assertEqual(second.dependencies, [first])
+        self.assertEqual((first.result, second.result), (42, 47))
+
+    def test_exception_fails_job(self):
+        job = CallableJob(targets.fail, 'broken', pool='thread')
+        dependent = Job('true', dependencies=[job])
+        with self.scheduler() as scheduler:
+            scheduler.run(dependent)
+        self.assertEqual((job.status, dependent.status), (FAILED, SKIPPED))
+        self.assertIsInstance(job.error, RuntimeError)
+        self.assertEqual(job.history[-1]['error'], repr(job.error))
+
+    def test_unknown_pool_is_rejected(self):
+        with self.assertRaises(ValueError):
+            CallableJob(targets.double, 1, pool='gpu')
+
+    def test_record_round_trip(self):
+        first = CallableJob(targets.double, 21)
+        second = CallableJob(targets.add, first, second=5, pool='thread')
+        data = second.to_dict()
+        self.assertEqual(data['args'], [{'$job': first.id}])
+        restored = CallableJob.from_dict(data)
+        self.assertEqual((restored.id, restored.func, restored.pool),
+                         (second.id, targets.add, 'thread'))
+        restored.dependencies = [first]
+        first.result = 42
+        self.assertEqual(restored._resolve(restored.args[0]), 42)
+
+    def test_finished_result_survives_restart(self):
+        start_at = (datetime.now() + timedelta(seconds=0.5)).isoformat()
+        first = CallableJob(targets.double, 21, pool='thread')
+        gate = Job('true', start_at=start_at)
+        second = CallableJob(targets.add, first, 5, pool='thread',
+                             dependencies=[gate])
+        with self.scheduler() as scheduler:
+            scheduler.submit(second)
+            scheduler.wait([first], timeout=10)
+            scheduler.shutdown(wait=False)
+        self.assertEqual(first.status, DONE)
+        with self.scheduler() as scheduler:
+            jobs = {job.id: job for job in scheduler.jobs}
+            self.assertEqual(jobs[first.id].status, DONE)
+            self.assertTrue(scheduler.wait(timeout=10))
+        self.assertEqual(jobs[second.id].status, DONE)
+        self.assertEqual(jobs[second.id].result, 47)
+
+    def test_unsaved_result_skips_dependents_after_restart(self):
+        start_at = (datetime.now() + timedelta(seconds=60)).isoformat()
+        first = CallableJob(targets.make_object, pool='thread')
+        gate = Job('true', start_at=start_at)
+        second = CallableJob(targets.add, first, 5, pool='thread',
+                             dependencies=[gate])
+        with self.scheduler() as scheduler:
+            scheduler.submit(second)
+            scheduler.wait([first], timeout=10)
+        with self.scheduler() as scheduler:
+            jobs = {job.id: job for job in scheduler.jobs}
+            self.assertEqual(jobs[first.id].status, FAILED)
+            self.assertEqual(jobs[second.id].status, SKIPPED)
+            scheduler.cancel(jobs[gate.id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+
+from job import DONE, FAILED, CoroutineJob, Job
+from tests import targets
+from tests.helpers import SchedulerTestCase
+
+
+class TestCoroutineJob(SchedulerTestCase):
+    def setUp(self):
+        super().setUp()
+        targets.active = targets.peak = 0
+
+    def test_coroutine_result(self):
+        job = CoroutineJob(targets.tracked, 0.01, value='ready')
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+        self.assertEqual((job.status, job.result), (DONE, 'ready'))
+
+    def test_generator_is_driven_on_loop(self):
+        job = CoroutineJob(targets.stepped, [1, 2, 3])
+        recovering = CoroutineJob(targets.recovering, 'boom')
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+            scheduler.run(recovering)
+        self.assertEqual(job.result, 6)
+        self.assertEqual(recovering.result, 'caught boom')
+
+    def test_exception_fails_job(self):
+        job = CoroutineJob(targets.raise_later, 'boom')
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(str(job.error), 'boom')
+
+    def test_max_working_time_cancels_coroutine(self):
+        job = CoroutineJob(targets.tracked, 10, max_working_time=0.2)
+        with self.scheduler() as scheduler:
+            start = time.monotonic()
+            scheduler.run(job)
+            elapsed = time.monotonic() - start
+        self.assertTrue(job.timed_out)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(targets.active, 0)
+
+    def test_plain_function_is_rejected(self):
+        with self.assertRaises(ValueError):
+            CoroutineJob(targets.double, 1)
+
+    def test_coroutines_are_limited_separately(self):
+        jobs = [CoroutineJob(targets.tracked, 0.1) for _ in range(6)]
+        with self.scheduler(pool_size=1, coroutines=3) as scheduler:
+            for job in jobs:
+                scheduler.submit(job)
+            self.assertTrue(scheduler.wait(timeout=10))
+        self.assertEqual(targets.peak, 3)
+
+    def test_coroutine_does_not_wait_for_pool_slot(self):
+        job = CoroutineJob(targets.tracked, 0.01)
+        with self.scheduler(pool_size=1) as scheduler:
+            scheduler.submit(Job('sleep 1'))
+            scheduler.submit(Job('sleep 1'))
+            start = time.monotonic()
+            scheduler.submit(job)
+            self.assertTrue(scheduler.wait([job], timeout=10))
+            elapsed = time.monotonic() - start
+            self.assertLess(elapsed, 0.5)
+            scheduler.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import time
+import unittest
+
+from dag import CycleError, JobGraph
+from job import DONE, FAILED, PENDING, SKIPPED, Job
+from tests.helpers import SchedulerTestCase
+
+
+class TestJobGraph(unittest.TestCase):
+    def test_diamond_is_released_by_last_dependency(self):
+        graph = JobGraph()
+        root = Job('root')
+        left = Job('left', dependencies=[root])
+        right = Job('right', dependencies=[root])
+        tail = Job('tail', dependencies=[left, right])
+        new, ready, skipped = graph.add(tail)
+        self.assertEqual(new[0], root)
+        self.assertEqual(new[-1], tail)
+        self.assertEqual((ready, skipped), ([root], []))
+        root.status = DONE
+        self.assertEqual(set(graph.complete(root)[0]), {left, right})
+        left.status = DONE
+        self.assertEqual(graph.complete(left), ([], []))
+        right.status = DONE
+        self.assertEqual(graph.complete(right), ([tail], []))
+        self.assertEqual(graph.blocked(), [])
+
+    def test_failure_skips_all_descendants(self):
+        graph = JobGraph()
+        first = Job('first')
+        second = Job('second', dependencies=[first])
+        third = Job('third', dependencies=[second])
+        other = Job('other')
+        both = Job('both', dependencies=[third, other])
+        graph.add(both)
+        first.status = FAILED
+        _, skipped = graph.complete(first)
+        self.assertEqual(set(skipped), {second, third, both})
+        self.assertEqual(other.status, PENDING)
+        # вторая зависимость завершается после того, как задача
+        # уже пропущена
+        other.status = DONE
+        self.assertEqual(graph.complete(other), ([], []))
+
+    def test_finished_dependency_is_not_waited_for(self):
+        graph = JobGraph()
+        done = Job('done')
+        done.status = DONE
+        failed = Job('failed')
+        failed.status = FAILED
+        first = Job('first', dependencies=[done])
+        second = Job('second', dependencies=[failed])
+        self.assertEqual(graph.add(first)[1:], ([first], []))
+        self.assertEqual(graph.add(second)[1:], ([], [second]))
+        self.assertEqual(second.status, SKIPPED)
+
+    def test_cycle_is_reported(self):
+        first = Job('first')
+        second = Job('second', dependencies=[first])
+        third = Job('third', dependencies=[second])
+        first.dependencies = [third]
+        with self.assertRaisesRegex(CycleError, 'first'):
+            JobGraph().add(third)
+
+    def test_long_chain_needs_no_recursion(self):
+        job = Job('0')
+        for i in range(1, 5000):
+            job = Job(str(i), dependencies=[job])
+        new, ready, _ = JobGraph().add(job)
+        self.assertEqual(len(new), 5000)
+        self.assertEqual([item.command for item in ready], ['0'])
+
+
+class TestDependencies(SchedulerTestCase):
+    def test_dependent_starts_after_dependency(self):
+        marker = self.path('marker')
+        first = Job(f'sleep 0.2; touch {marker}')
+        second = Job(f'test -f {marker}', dependencies=[first])
+        with self.scheduler() as scheduler:
+            scheduler.run(second)
+        self.assertEqual((first.status, second.status), (DONE, DONE))
+
+    def test_independent_branches_run_in_parallel(self):
+        branches = [Job(self.traced(i, 0.4)) for i in range(3)]
+        tail = Job('true', dependencies=branches)
+        with self.scheduler(pool_size=3) as scheduler:
+            start = time.monotonic()
+            scheduler.run(tail)
+            elapsed = time.monotonic() - start
+        self.assertEqual(tail.status, DONE)
+        self.assertEqual(self.peak(), 3)
+        self.assertLess(elapsed, 1.0)
+
+    def test_failed_dependency_skips_dependents(self):
+        first = Job('exit 1')
+        second = Job('true', dependencies=[first])
+        third = Job('true', dependencies=[second])
+        with self.scheduler() as scheduler:
+            scheduler.run(third)
+        self.assertEqual([first.status, second.status, third.status],
+                         [FAILED, SKIPPED, SKIPPED])
+        self.assertEqual(second.attempts, 0)
+
+    def test_cycle_is_rejected_on_submit(self):
+        first = Job('true')
+        second = Job('true', dependencies=[first])
+        first.dependencies = [second]
+        with self.scheduler() as scheduler:
+            with self.assertRaises(CycleError):
+                scheduler.submit(second)
+            self.assertEqual(scheduler.submitted, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
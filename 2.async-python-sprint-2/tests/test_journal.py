@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import journal
+from job import DONE, FAILED, PENDING, RUNNING, Job
+from journal import Journal
+from tests.helpers import SchedulerTestCase
+
+
+def record(key: str, status: str = PENDING, **fields) -> dict:
+    return {'id': key, 'status': status, 'dependencies': [], **fields}
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = Journal(self.tmp.name)
+        self.journal.recover()
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def reopen(self, **kwargs) -> dict:
+        self.journal.close()
+        self.journal = Journal(self.tmp.name, **kwargs)
+        return self.journal.recover()
+
+    def test_recover_keeps_only_unfinished(self):
+        self.assertTrue(self.journal.append(record('a')))
+        self.assertFalse(self.journal.append(record('b')))
+        self.journal.append(record('a', RUNNING))
+        self.journal.append(record('b', FAILED))
+        self.assertTrue(self.journal.pending)
+        self.assertEqual(self.journal.commit(), 4)
+        self.assertFalse(self.journal.pending)
+        self.assertEqual(self.reopen(), {'a': record('a', RUNNING)})
+
+    def test_snapshot_truncates_journal(self):
+        self.reopen(snapshot_every=3)
+        for key in 'abc':
+            self.journal.append(record(key))
+        self.journal.commit()
+        self.assertEqual(os.path.getsize(self.journal.journal_path), 0)
+        with open(self.journal.snapshot_path) as file:
+            self.assertEqual(set(json.load(file)), set('abc'))
+        self.journal.append(record('a', DONE))
+        self.journal.commit()
+        self.assertEqual(set(self.reopen()), set('bc'))
+
+    def test_torn_tail_is_ignored(self):
+        self.journal.append(record('a'))
+        self.journal.commit()
+        with open(self.journal.journal_path, 'a') as file:
+            file.write('{"id": "b", "sta')
+        self.assertEqual(set(self.reopen()), {'a'})
+
+    def test_done_record_is_kept_for_dependents(self):
+        self.journal.append(record('a'))
+        self.journal.append(record('b', dependencies=['a']))
+        self.journal.append(record('a', DONE, result=42))
+        self.journal.commit()
+        recovered = self.reopen()
+        self.assertEqual(recovered['a']['result'], 42)
+        self.journal.append(record('b', DONE, dependencies=['a']))
+        self.journal.commit()
+        self.assertEqual(self.reopen(), {})
+
+    def test_snapshot_is_serialised_outside_lock(self):
+        for key in 'abc':
+            self.journal.append(record(key))
+        dumps = json.dumps
+
+        def unlocked_dumps(*args, **kwargs):
+            self.assertFalse(self.journal._lock.locked())
+            return dumps(*args, **kwargs)
+
+        with unittest.mock.patch.object(journal.json, 'dumps',
+                                        unlocked_dumps):
+            self.journal.snapshot()
+        with open(self.journal.snapshot_path) as file:
+            self.assertEqual(set(json.load(file)), set('abc'))
+
+
+class TestSchedulerJournal(SchedulerTestCase):
+    def test_commits_while_running(self):
+        with self.scheduler() as scheduler:
+            job = scheduler.submit(Job('sleep 0.5'))
+            path = os.path.join(self.state_dir, Journal.journal_name)
+            deadline = time.monotonic() + 0.4
+            while not os.path.getsize(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with open(path) as file:
+                states = [json.loads(line)['status'] for line in file]
+            self.assertIn(RUNNING, states)
+            self.assertEqual(job.status, RUNNING)
+
+    def test_records_made_before_loop_are_committed(self):
+        broken = Job('true').to_dict()
+        broken.update(command='tests.no_such_module:func', kind='call',
+                      pool='thread', args=[], kwargs={})
+        log = Journal(self.state_dir)
+        log.recover()
+        log.append(broken)
+        log.close()
+        scheduler = self.scheduler()
+        try:
+            self.assertEqual(scheduler.jobs[0].status, FAILED)
+            scheduler.run(Job('true'))
+            path = os.path.join(self.state_dir, Journal.journal_name)
+            deadline = time.monotonic() + 2
+            while not os.path.getsize(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(os.path.getsize(path))
+        finally:
+            scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import subprocess
+import unittest
+
+from job import (DONE, PENDING, PLANNED, RUNNING, Job, boot_id,
+                 process_start)
+from journal import Journal
+from tests.helpers import SchedulerTestCase
+
+
+class TestRecovery(SchedulerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.process = subprocess.Popen(['sleep', '30'],
+                                        start_new_session=True)
+
+    def tearDown(self):
+        self.process.kill()
+        self.process.wait()
+        super().tearDown()
+
+    def crashed(self, job: Job, **lease) -> None:
+        """Журнал, оставшийся после сбоя во время запуска job"""
+        data = job.to_dict()
+        data.update(status=RUNNING, **lease)
+        log = Journal(self.state_dir)
+        log.recover()
+        log.append(data)
+        log.close()
+
+    def test_pending_jobs_are_restored(self):
+        start_at = (datetime.now() + timedelta(seconds=60)).isoformat()
+        delayed = Job('true', start_at=start_at, tries=2)
+        dependent = Job(f'touch {self.path("done")}',
+                        dependencies=[delayed])
+        with self.scheduler() as scheduler:
+            scheduler.submit(dependent)
+        self.assertEqual(dependent.status, PLANNED)
+        with self.scheduler() as scheduler:
+            jobs = {job.id: job for job in scheduler.jobs}
+            self.assertEqual(set(jobs), {delayed.id, dependent.id})
+            restored = jobs[delayed.id]
+            self.assertEqual((restored.start_at, restored.tries),
+                             (start_at, 2))
+            self.assertEqual(jobs[dependent.id].dependencies, [restored])
+            self.assertEqual(restored.status, PENDING)
+            self.assertEqual(scheduler.timer_stats()['pending'], 1)
+
+    def test_interrupted_run_is_killed_and_restarted(self):
+        pid = self.process.pid
+        job = Job(f'touch {self.path("done")}')
+        self.crashed(job, pid=pid, pid_start=process_start(pid),
+                     boot_id=boot_id())
+        with self.scheduler() as scheduler:
+            restored = scheduler.jobs[0]
+            scheduler.wait(timeout=10)
+        self.assertEqual(self.process.wait(timeout=5), -9)
+        self.assertEqual((restored.id, restored.status), (job.id, DONE))
+
+    def test_reused_pid_is_not_killed(self):
+        pid = self.process.pid
+        self.crashed(Job('true'), pid=pid,
+                     pid_start=process_start(pid) - 1, boot_id=boot_id())
+        with self.scheduler() as scheduler:
+            scheduler.wait(timeout=10)
+        self.assertIsNone(self.process.poll())
+
+    def test_pid_from_previous_boot_is_not_killed(self):
+        pid = self.process.pid
+        self.crashed(Job('true'), pid=pid, pid_start=process_start(pid),
+                     boot_id='previous-boot')
+        with self.scheduler() as scheduler:
+            scheduler.wait(timeout=10)
+            self.assertEqual(scheduler.jobs[0].status, DONE)
+        self.assertIsNone(self.process.poll())
+
+    def test_lease_is_journaled(self):
+        with self.scheduler() as scheduler:
+            job = scheduler.submit(Job('sleep 0.5'))
+            state = scheduler._journal.state
+            while not state.get(job.id, {}).get('pid'):
+                scheduler.wait([job], timeout=0.01)
+            lease = state[job.id]
+            self.assertEqual((lease['status'], lease['pid']),
+                             (RUNNING, job.pid))
+            self.assertEqual(lease['pid_start'], process_start(job.pid))
+        self.assertEqual(lease['boot_id'], boot_id())
+
+if __name__ == '__main__':
+    unittest.main()
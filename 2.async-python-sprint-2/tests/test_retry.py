@@ -0,0 +1,84 @@
+import time
+import unittest
+import unittest.mock
+
+from job import DONE, FAILED, PENDING, Job, RetryPolicy
+from tests.helpers import SchedulerTestCase
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_delay_grows_exponentially_up_to_limit(self):
+        policy = RetryPolicy(base=0.5, factor=3, max_delay=10, jitter=0)
+        self.assertEqual([policy.delay(attempt) for attempt in range(1, 6)],
+                         [0.5, 1.5, 4.5, 10, 10])
+        self.assertEqual(policy.delay(10 ** 6), 10)
+
+    def test_huge_growth_is_capped(self):
+        for factor in (1e10, 10 ** 400):
+            policy = RetryPolicy(base=1, factor=factor, max_delay=30,
+                                 jitter=0)
+            self.assertEqual(policy.delay(64), 30)
+            self.assertEqual(policy.delay(10 ** 9), 30)
+
+    def test_jitter_stays_within_bounds(self):
+        policy = RetryPolicy(base=1, factor=2, max_delay=60, jitter=0.1)
+        with unittest.mock.patch('job.random.random', return_value=0.0):
+            self.assertAlmostEqual(policy.delay(2), 1.8)
+        with unittest.mock.patch('job.random.random', return_value=1.0):
+            self.assertAlmostEqual(policy.delay(2), 2.2)
+            self.assertEqual(policy.delay(7), 60)
+
+
+class TestRetries(SchedulerTestCase):
+    fast = RetryPolicy(base=0.1, factor=2, max_delay=1, jitter=0)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = Job(f'echo run >> {self.log}; exit 1', tries=2,
+                  retry=self.fast)
+        with self.scheduler() as scheduler:
+            start = time.monotonic()
+            scheduler.run(job)
+            elapsed = time.monotonic() - start
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual([run['attempt'] for run in job.history], [1, 2, 3])
+        self.assertEqual(len(self.events()), 3)
+        self.assertGreater(elapsed, 0.3)
+
+    def test_job_succeeds_on_retry(self):
+        marker = self.path('marker')
+        job = Job(f'test -f {marker} || {{ touch {marker}; exit 1; }}',
+                  tries=3)
+        with self.scheduler(retry=self.fast) as scheduler:
+            scheduler.run(job)
+        self.assertEqual((job.status, job.attempts), (DONE, 2))
+        self.assertEqual([run['exit_code'] for run in job.history], [1, 0])
+
+    def test_waiting_retry_frees_its_slot(self):
+        flaky = Job('exit 1', tries=1,
+                    retry=RetryPolicy(base=0.5, jitter=0))
+        other = Job('true')
+        with self.scheduler(pool_size=1) as scheduler:
+            scheduler.submit(flaky)
+            while flaky.attempts == 0:
+                scheduler.wait([flaky], timeout=0.01)
+            scheduler.run(other)
+            self.assertEqual((other.status, flaky.status), (DONE, PENDING))
+            self.assertTrue(scheduler.wait(timeout=10))
+        self.assertEqual((flaky.status, flaky.attempts), (FAILED, 2))
+
+    def test_retry_time_survives_restart(self):
+        job = Job('true', tries=1, retry=RetryPolicy(base=60, jitter=0))
+        job.retry_at = time.time() + 60
+        with self.scheduler() as scheduler:
+            scheduler.submit(job)
+        with self.scheduler() as scheduler:
+            restored = scheduler.jobs[0]
+            self.assertEqual(restored.retry_at, job.retry_at)
+            self.assertEqual(restored.retry, job.retry)
+            self.assertEqual(scheduler.timer_stats()['pending'], 1)
+            scheduler.cancel(restored)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import time
+import unittest
+
+from job import DONE, FAILED, PLANNED, Job
+from tests.helpers import SchedulerTestCase
+
+
+class TestConcurrency(SchedulerTestCase):
+    def test_pool_size_limits_running_jobs(self):
+        with self.scheduler(pool_size=2) as scheduler:
+            jobs = [scheduler.submit(Job(self.traced(i, 0.2)))
+                    for i in range(6)]
+            self.assertTrue(scheduler.wait(timeout=10))
+        self.assertEqual({job.status for job in jobs}, {DONE})
+        self.assertEqual(len(self.events()), 12)
+        self.assertEqual(self.peak(), 2)
+
+    def test_free_slot_is_taken_at_once(self):
+        with self.scheduler(pool_size=2) as scheduler:
+            start = time.monotonic()
+            scheduler.submit(Job(self.traced('long', 0.9)))
+            for i in range(3):
+                scheduler.submit(Job(self.traced(i, 0.2)))
+            scheduler.wait(timeout=10)
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.4)
+        self.assertEqual(self.events()[-1], ['end', 'long'])
+
+    def test_submit_does_not_wait_for_job(self):
+        with self.scheduler() as scheduler:
+            start = time.monotonic()
+            job = scheduler.submit(Job('sleep 0.5'))
+            self.assertLess(time.monotonic() - start, 0.3)
+            self.assertFalse(scheduler.wait([job], timeout=0.1))
+            self.assertTrue(scheduler.wait([job], timeout=10))
+
+    def test_run_waits_for_job(self):
+        target = self.path('touched')
+        with self.scheduler() as scheduler:
+            job = scheduler.new(f'touch {target}')
+            scheduler.run(job)
+            self.assertTrue(os.path.exists(target))
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(job.exit_code, 0)
+        self.assertEqual(scheduler.jobs, [job])
+
+    def test_failed_command(self):
+        with self.scheduler() as scheduler:
+            job = Job('exit 3')
+            scheduler.run(job)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.exit_code, 3)
+
+    def test_shutdown_without_wait_keeps_queued_jobs(self):
+        scheduler = self.scheduler(pool_size=1)
+        jobs = [scheduler.submit(Job('sleep 0.3')) for _ in range(3)]
+        time.sleep(0.1)
+        scheduler.shutdown(wait=False)
+        self.assertEqual(jobs[0].status, DONE)
+        self.assertEqual([job.status for job in jobs[1:]], [PLANNED] * 2)
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(Job('true'))
+
+
+if __name__ == '__main__':
+    unittest.main()
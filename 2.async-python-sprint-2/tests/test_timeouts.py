@@ -0,0 +1,63 @@
+import signal
+import time
+import unittest
+
+from job import FAILED, Job
+from tests.helpers import SchedulerTestCase
+
+
+def alive(pid: int) -> bool:
+    """Процесс существует и не стал зомби"""
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            return file.read().rpartition(')')[2].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestWorkingTime(SchedulerTestCase):
+    def test_overrunning_job_is_terminated(self):
+        job = Job('sleep 10', max_working_time=0.2)
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+        self.assertEqual(job.status, FAILED)
+        self.assertTrue(job.timed_out)
+        self.assertEqual(job.signal, signal.SIGTERM)
+        self.assertLess(job.duration, 2)
+        self.assertIsNone(job.pid)
+
+    def test_job_ignoring_term_is_killed(self):
+        job = Job("trap '' TERM; sleep 10", max_working_time=0.2)
+        job.kill_timeout = 0.3
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+        self.assertTrue(job.timed_out)
+        self.assertEqual(job.signal, signal.SIGKILL)
+        self.assertLess(job.duration, 2)
+
+    def test_whole_process_group_is_stopped(self):
+        job = Job(f'sleep 10 & echo $! > {self.path("child")}; wait',
+                  max_working_time=0.2)
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+        with open(self.path('child')) as file:
+            child = int(file.read())
+        deadline = time.monotonic() + 2
+        while alive(child) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertFalse(alive(child))
+
+    def test_jobs_wait_without_blocking_each_other(self):
+        jobs = [Job('sleep 0.5') for _ in range(4)]
+        with self.scheduler(pool_size=4) as scheduler:
+            start = time.monotonic()
+            for job in jobs:
+                scheduler.submit(job)
+            scheduler.wait(timeout=10)
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.2)
+        self.assertEqual(sum(job.attempts for job in jobs), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+import time
+import unittest
+
+from job import CANCELLED, DONE, PENDING, SKIPPED, Job
+from tests.helpers import SchedulerTestCase
+from timers import TimerQueue
+
+
+def later(seconds: float) -> str:
+    return (datetime.now() + timedelta(seconds=seconds)).isoformat()
+
+
+class TestTimerQueue(unittest.TestCase):
+    def test_jobs_fire_in_time_order(self):
+        timers = TimerQueue()
+        jobs = [Job(str(i)) for i in range(3)]
+        self.assertTrue(timers.push(jobs[1], 20.0))
+        self.assertFalse(timers.push(jobs[2], 30.0))
+        self.assertTrue(timers.push(jobs[0], 10.0))
+        self.assertEqual(timers.pop_due(5.0), ([], 5.0))
+        self.assertEqual(timers.pop_due(21.0), (jobs[:2], 9.0))
+        self.assertEqual(timers.pop_due(31.0), ([jobs[2]], None))
+        stats = timers.stats()
+        self.assertEqual((stats['fired'], stats['pending']), (3, 0))
+        self.assertEqual(stats['max_lateness'], 11.0)
+
+    def test_cancelled_job_does_not_fire(self):
+        timers = TimerQueue()
+        first, second = Job('first'), Job('second')
+        timers.push(first, 10.0)
+        timers.push(second, 20.0)
+        self.assertTrue(timers.cancel(first))
+        self.assertFalse(timers.cancel(first))
+        self.assertNotIn(first, timers)
+        self.assertEqual(timers.pop_due(15.0), ([], 5.0))
+        self.assertEqual(timers.drain(), [second])
+        self.assertEqual(len(timers), 0)
+
+    def test_heap_is_compacted_after_cancels(self):
+        timers = TimerQueue()
+        jobs = [Job(str(i)) for i in range(1000)]
+        for i, job in enumerate(jobs):
+            timers.push(job, float(i))
+            timers.cancel(job)
+        self.assertLess(len(timers._heap), 100)
+
+
+class TestStartAt(SchedulerTestCase):
+    def test_job_waits_for_start_at(self):
+        job = Job('true', start_at=later(0.3))
+        with self.scheduler() as scheduler:
+            start = time.monotonic()
+            scheduler.run(job)
+            elapsed = time.monotonic() - start
+            stats = scheduler.timer_stats()
+        self.assertEqual(job.status, DONE)
+        self.assertGreater(elapsed, 0.25)
+        self.assertEqual(stats['fired'], 1)
+        self.assertLess(stats['max_lateness'], 0.2)
+
+    def test_delayed_jobs_do_not_take_slots(self):
+        delayed = Job('true', start_at=later(60))
+        with self.scheduler(pool_size=1) as scheduler:
+            scheduler.submit(delayed)
+            scheduler.run(Job('true'))
+            self.assertEqual(delayed.status, PENDING)
+            self.assertTrue(scheduler.cancel(delayed))
+
+    def test_cancel_skips_dependents(self):
+        delayed = Job('true', start_at=later(60))
+        dependent = Job('true', dependencies=[delayed])
+        with self.scheduler() as scheduler:
+            scheduler.submit(dependent)
+            self.assertTrue(scheduler.cancel(delayed))
+            self.assertTrue(scheduler.wait(timeout=1))
+        self.assertEqual((delayed.status, dependent.status),
+                         (CANCELLED, SKIPPED))
+
+    def test_only_delayed_jobs_can_be_cancelled(self):
+        job = Job('true')
+        with self.scheduler() as scheduler:
+            scheduler.run(job)
+            self.assertFalse(scheduler.cancel(job))
+        self.assertEqual(job.status, DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import heapq
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from job import Job
+
+
+class TimerQueue:
+    """Отложенные задачи на куче с ленивым удалением, ключ – время
+    запуска в секундах эпохи. Добавление и отмена – O(log n) и O(1),
+    выборка наступивших – O(k log n); на задачу не заводится ни поток,
+    ни таймер. Считает опоздание срабатывания относительно времени
+    запуска"""
+
+    def __init__(self):
+        self._entries: Dict[Job, tuple] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self.fired = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, job: Job) -> bool:
+        return job in self._entries
+
+    def push(self, job: Job, when: float) -> bool:
+        """Откладывает задачу до when; True, если она стала ближайшей
+        и спящий диспетчер нужно разбудить"""
+        entry = (when, next(self._seq), job)
+        self._entries[job] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        return self._head() is entry
+
+    def cancel(self, job: Job) -> bool:
+        """Снимает задачу; запись в куче удаляется лениво"""
+        return self._entries.pop(job, None) is not None
+
+    def pop_due(self, now: float) -> Tuple[List[Job], Optional[float]]:
+        """Наступившие задачи и время до следующего срабатывания
+        (None, если очередь пуста)"""
+        due = []
+        while True:
+            entry = self._head()
+            if entry is None:
+                return due, None
+            when, _, job = entry
+            if when > now:
+                return due, when - now
+            heapq.heappop(self._heap)
+            del self._entries[job]
+            lateness = now - when
+            self.fired += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            due.append(job)
+
+    def drain(self) -> List[Job]:
+        """Забирает все ещё не наступившие задачи по порядку"""
+        jobs = [job for _, _, job in sorted(self._entries.values())]
+        self._entries.clear()
+        self._heap = []
+        return jobs
+
+    def stats(self) -> dict:
+        """Точность срабатывания: число срабатываний, среднее
+        и максимальное опоздание в секундах"""
+        mean = self.total_lateness / self.fired if self.fired else 0.0
+        return {'fired': self.fired, 'pending': len(self._entries),
+                'mean_lateness': mean, 'max_lateness': self.max_lateness}
+
+    def _head(self) -> Optional[tuple]:
+        """Ближайшая действующая запись; отменённые снимаются с вершины"""
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None